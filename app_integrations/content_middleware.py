@@ -1,23 +1,33 @@
+import asyncio
 import re
-from typing import List, Dict
+import weakref
+from typing import List, Dict, Optional
 import logging
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from urllib.parse import urlparse
 import os
+import time
 import dotenv
 
 dotenv.load_dotenv()
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app_integrations.youtube_file import get_transcript_from_url
+from app_integrations.youtube_file import extract_video_id, get_transcript_from_url
+from app_integrations.driver_pool import create_pool
+from app_integrations.http_fetcher import TierStats, create_http_client, fetch_static
+from app_integrations.url_cache import URL_CACHE_PAGE_TTL_SECONDS, URLContentCache, normalize_url
 
 logger = logging.getLogger(__name__)
 
+# Pattern matches http/https URLs including query parameters, fragments, etc.
+URL_PATTERN = re.compile(r'https?://(?:[-\w.@]|(?:%[\da-fA-F]{2})|[/?=&])+(?=\s|\n|$)')
+
 def extract_urls(text: str) -> List[str]:
     """
     Extract all URLs from a given text, including query parameters.
@@ -28,9 +38,7 @@ def extract_urls(text: str) -> List[str]:
     Returns:
         List[str]: List of extracted URLs
     """
-    # Pattern matches http/https URLs including query parameters, fragments, etc.
-    url_pattern = r'https?://(?:[-\w.@]|(?:%[\da-fA-F]{2})|[/?=&])+(?=\s|\n|$)'
-    return re.findall(url_pattern, text)
+    return re.findall(URL_PATTERN, text)
 
 def setup_selenium_driver():
     """
@@ -46,113 +54,303 @@ def setup_selenium_driver():
     driver = webdriver.Chrome(options=chrome_options)
     return driver
 
-def scrape_webpage(url: str) -> str:
+# Elements dropped before extracting text, and the main-content areas tried in order
+UNWANTED_TAGS = ['script', 'style', 'nav', 'footer', 'header']
+CONTENT_SELECTORS = [
+    "article",
+    "main",
+    ".content",
+    "#content",
+    ".post-content",
+    ".article-content"
+]
+
+# Removes unwanted elements and returns the text of the first matching content
+# selector (or the body) in a single round trip to the browser
+EXTRACT_CONTENT_SCRIPT = """
+    var unwantedTags = arguments[0];
+    var contentSelectors = arguments[1];
+
+    unwantedTags.forEach(function (tag) {
+        document.querySelectorAll(tag).forEach(function (element) {
+            element.parentNode.removeChild(element);
+        });
+    });
+
+    for (var i = 0; i < contentSelectors.length; i++) {
+        var elements;
+        try {
+            elements = document.querySelectorAll(contentSelectors[i]);
+        } catch (e) {
+            continue;
+        }
+        if (elements.length) {
+            var text = Array.prototype.map.call(elements, function (element) {
+                return element.innerText;
+            }).join(" ");
+            if (text.trim()) {
+                return text;
+            }
+            break;
+        }
+    }
+
+    return document.body ? document.body.innerText : "";
+"""
+
+# Warm browsers shared by every scrape in this process. A browser that hit
+# its deadline may still be busy with the page, so it's replaced.
+driver_pool = create_pool(setup_selenium_driver, discard_on=(TimeoutException,))
+
+# How often each fetch tier (plain HTTP, browser) is used, and its latency
+fetch_stats = TierStats()
+
+# Extracted page text and transcripts shared across users and restarts
+url_cache = URLContentCache()
+
+def remaining(deadline: float) -> float:
+    # Selenium rejects zero timeouts, so an expired deadline still allows a moment
+    return max(0.1, deadline - time.monotonic())
+
+def extract_page_text(driver, url: str, timeout: Optional[float] = None) -> str:
+    """
+    Load a URL in the given driver and return its cleaned main-content text.
+
+    The browser itself gives up after timeout seconds (page load, wait and
+    extraction together) by raising TimeoutException, so a slow page can't
+    hold the driver and its thread past the caller's deadline.
+    """
+    deadline = time.monotonic() + (timeout or URL_FETCH_TIMEOUT_SECONDS)
+    driver.set_page_load_timeout(remaining(deadline))
+    driver.get(url)
+
+    # Wait for the body to be present
+    WebDriverWait(driver, min(10, remaining(deadline))).until(
+        EC.presence_of_element_located((By.TAG_NAME, "body"))
+    )
+
+    driver.set_script_timeout(remaining(deadline))
+    content = driver.execute_script(EXTRACT_CONTENT_SCRIPT, UNWANTED_TAGS, CONTENT_SELECTORS)
+
+    # Clean up the text
+    return re.sub(r'\s+', ' ', content or '').strip()
+
+def scrape_webpage(url: str, use_pool: bool = True, timeout: Optional[float] = None) -> str:
     """
     Scrape content from a webpage using Selenium.
     
     Args:
         url (str): URL to scrape
+        use_pool (bool): Borrow a warm driver from driver_pool instead of
+            launching a fresh browser for this URL
+        timeout (float): Seconds allowed, including the wait for a pooled
+            driver (defaults to URL_FETCH_TIMEOUT_SECONDS)
     
     Returns:
         str: Extracted text content
     """
-    driver = None
+    deadline = time.monotonic() + (timeout or URL_FETCH_TIMEOUT_SECONDS)
     try:
+        if use_pool:
+            with driver_pool.driver(timeout=remaining(deadline)) as driver:
+                return extract_page_text(driver, url, remaining(deadline))
+
         driver = setup_selenium_driver()
-        driver.get(url)
-        
-        # Wait for the body to be present
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
-        
-        # Remove unnecessary elements
-        unwanted_tags = ['script', 'style', 'nav', 'footer', 'header']
-        for tag in unwanted_tags:
-            elements = driver.find_elements(By.TAG_NAME, tag)
-            for element in elements:
-                driver.execute_script("""
-                    var element = arguments[0];
-                    element.parentNode.removeChild(element);
-                """, element)
-        
-        # Get the main content
-        # First try to find main content areas
-        content_selectors = [
-            "article",
-            "main",
-            ".content",
-            "#content",
-            ".post-content",
-            ".article-content"
-        ]
-        
-        content = ""
-        for selector in content_selectors:
-            try:
-                elements = driver.find_elements(By.CSS_SELECTOR, selector)
-                if elements:
-                    content = " ".join(element.text for element in elements)
-                    break
-            except:
-                continue
-        
-        # If no content found with specific selectors, get body text
-        if not content:
-            content = driver.find_element(By.TAG_NAME, "body").text
-        
-        # Clean up the text
-        content = re.sub(r'\s+', ' ', content).strip()
-        
-        # Replace the URL with the content in the original text
-        return content
+        try:
+            return extract_page_text(driver, url, remaining(deadline))
+        finally:
+            driver.quit()
         
     except Exception as e:
         logger.error(f"Error scraping webpage {url}: {str(e)}")
         return f"Error scraping content: {str(e)}"
-    
-    finally:
-        if driver:
-            driver.quit()
 
-def get_complete_content(text: str) -> str:
+# URLs are resolved concurrently: blocking fetches run on worker threads, at most
+# URL_PER_HOST_CONCURRENCY at a time per host across all requests in the process,
+# and each gives up after URL_FETCH_TIMEOUT_SECONDS
+URL_FETCH_TIMEOUT_SECONDS = float(os.getenv("URL_FETCH_TIMEOUT_SECONDS", "30"))
+URL_PER_HOST_CONCURRENCY = int(os.getenv("URL_PER_HOST_CONCURRENCY", "2"))
+
+# Per-host semaphores, per event loop: get_complete_content runs each call in
+# its own loop, and a semaphore can't be shared between loops
+_host_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[tuple, asyncio.Semaphore]]" = \
+    weakref.WeakKeyDictionary()
+
+def host_limit(url: str, per_host: int) -> asyncio.Semaphore:
+    limits = _host_limits.setdefault(asyncio.get_running_loop(), {})
+    return limits.setdefault((host_key(url), per_host), asyncio.Semaphore(per_host))
+
+def is_youtube_url(url: str) -> bool:
+    domain = urlparse(url).netloc.lower()
+    return 'youtube.com' in domain or 'youtu.be' in domain
+
+def host_key(url: str) -> str:
+    # youtube.com and youtu.be links hit the same backend, so they share a limit
+    return 'youtube' if is_youtube_url(url) else urlparse(url).netloc.lower()
+
+async def fetch_webpage(client, url: str, deadline: Optional[float] = None) -> str:
     """
-    Process text to extract and fetch content from all URLs, replacing them with their content.
+    Fetch a page's text with a plain HTTP GET, and only launch the browser
+    when that fails, looks JS-rendered, or yields too little text.
+
+    Fresh cached copies are returned without any request; stale ones are
+    revalidated with a conditional GET and reused on 304. The browser scrape
+    stops at deadline (a time.monotonic() value).
+    """
+    key = normalize_url(url)
+    cached = await asyncio.to_thread(url_cache.get, key)
+    if cached and cached.fresh:
+        return cached.content
+
+    started = time.perf_counter()
+    result = await fetch_static(
+        client, url, CONTENT_SELECTORS, UNWANTED_TAGS,
+        etag=cached.etag if cached else None,
+        last_modified=cached.last_modified if cached else None
+    )
+    fetch_stats.record("http", (time.perf_counter() - started) * 1000,
+                       served=result.text is not None or result.not_modified)
+
+    if result.not_modified:
+        if cached is not None:
+            await asyncio.to_thread(url_cache.renew, key, URL_CACHE_PAGE_TTL_SECONDS)
+            return cached.content
+        # Nothing to reuse (e.g. the entry was evicted meanwhile): fetch unconditionally
+        started = time.perf_counter()
+        result = await fetch_static(client, url, CONTENT_SELECTORS, UNWANTED_TAGS)
+        fetch_stats.record("http", (time.perf_counter() - started) * 1000, served=result.text is not None)
+
+    content = result.text
+    if content is None:
+        logger.info(f"Falling back to browser for {url}: {result.fallback_reason}")
+        fetch_stats.record_fallback(result.fallback_reason)
+        started = time.perf_counter()
+        timeout = remaining(deadline) if deadline is not None else None
+        content = await asyncio.to_thread(scrape_webpage, url, True, timeout)
+        fetch_stats.record("browser", (time.perf_counter() - started) * 1000, served=True)
+        if content.startswith("Error scraping content:"):
+            return content
+
+    # Validators from the HTTP tier let browser-rendered pages be revalidated too
+    await asyncio.to_thread(
+        url_cache.put, key, "page", content, result.etag, result.last_modified, URL_CACHE_PAGE_TTL_SECONDS
+    )
+    return content
+
+async def fetch_transcript(url: str) -> str:
+    """
+    Fetch a YouTube transcript. Transcripts don't change, so cached ones never expire.
+    """
+    key = normalize_url(url, extract_video_id(url))
+    cached = await asyncio.to_thread(url_cache.get, key)
+    if cached:
+        return cached.content
+
+    transcript = await asyncio.to_thread(get_transcript_from_url, url)
+    if transcript:
+        await asyncio.to_thread(url_cache.put, key, "transcript", transcript)
+    return transcript
+
+async def fetch_url_content(client, url: str, deadline: Optional[float] = None) -> str:
+    """
+    Fetch the content behind one URL: a transcript for YouTube, page text otherwise.
+    """
+    if is_youtube_url(url):
+        # Handle YouTube URLs
+        return await fetch_transcript(url)
+    # Handle other URLs over HTTP, with Selenium as the fallback
+    return await fetch_webpage(client, url, deadline)
+
+async def resolve_urls(urls: List[str], timeout: float = URL_FETCH_TIMEOUT_SECONDS,
+                       per_host: int = URL_PER_HOST_CONCURRENCY) -> Dict[str, str]:
+    """
+    Fetch the content of several URLs concurrently.
+
+    Args:
+        urls (List[str]): URLs to fetch; duplicates are fetched once
+        timeout (float): Seconds allowed per URL
+        per_host (int): Maximum concurrent fetches per host, shared with
+            every other resolve_urls call in this event loop
+
+    Returns:
+        Dict[str, str]: Replacement text for each distinct URL
+    """
+    async def resolve(url: str) -> str:
+        try:
+            async with host_limit(url, per_host):
+                # wait_for can't stop a scrape running on a thread, so the
+                # scrape is given the same deadline and stops on its own
+                deadline = time.monotonic() + timeout
+                content = await asyncio.wait_for(fetch_url_content(client, url, deadline), timeout)
+            return f"\n\nContent from {url}:\n{content}\n\n"
+        except asyncio.TimeoutError:
+            logger.error(f"Timed out processing URL {url} after {timeout}s")
+            return f"\n\nError processing content from {url}: timed out after {timeout}s\n\n"
+        except Exception as e:
+            logger.error(f"Error processing URL {url}: {str(e)}")
+            return f"\n\nError processing content from {url}: {str(e)}\n\n"
+
+    distinct = list(dict.fromkeys(urls))
+    if not distinct:
+        return {}
+
+    async with create_http_client() as client:
+        replacements = await asyncio.gather(*(resolve(url) for url in distinct))
+    return dict(zip(distinct, replacements))
+
+async def get_content_segments(text: str) -> List[str]:
+    """
+    Fetch the content of every URL in the text and return the text split into
+    segments: the text between URLs, and one segment per URL with its content.
+
+    Joining the segments gives the complete content. Keeping each URL's content
+    in its own segment lets callers chunk it independently of the surrounding
+    message, so a cached URL always yields the same chunks (and cached embeddings).
+    
+    All URLs are fetched concurrently, so the total latency is close to that of
+    the slowest URL, and the segments are assembled in one pass over the text.
     
     Args:
         text (str): Input text containing URLs
     
     Returns:
-        str: Text with URLs replaced by their content
+        List[str]: Text segments with URLs replaced by their content
     """
     try:
-        urls = extract_urls(text)
-        result_text = text
-        
-        for url in urls:
-            try:
-                parsed_url = urlparse(url)
-                domain = parsed_url.netloc.lower()
-                
-                if 'youtube.com' in domain or 'youtu.be' in domain:
-                    # Handle YouTube URLs
-                    content = get_transcript_from_url(url)
-                else:
-                    # Handle other URLs with Selenium
-                    content = scrape_webpage(url)
-                    
-                # Replace the URL with its content
-                result_text = result_text.replace(url, f"\n\nContent from {url}:\n{content}\n\n")
-                
-            except Exception as e:
-                logger.error(f"Error processing URL {url}: {str(e)}")
-                result_text = result_text.replace(url, f"\n\nError processing content from {url}: {str(e)}\n\n")
-        
-        return result_text
+        replacements = await resolve_urls(extract_urls(text))
+        if not replacements:
+            return [text]
+
+        segments = []
+        position = 0
+        for match in URL_PATTERN.finditer(text):
+            segments.append(text[position:match.start()])
+            segments.append(replacements[match.group(0)])
+            position = match.end()
+        segments.append(text[position:])
+        return segments
         
     except Exception as e:
         logger.error(f"Error in get_complete_content: {str(e)}")
-        return f"Error processing content: {str(e)}"
+        return [f"Error processing content: {str(e)}"]
+
+async def get_complete_content_async(text: str) -> str:
+    """
+    Process text to extract and fetch content from all URLs, replacing them with their content.
+    
+    Args:
+        text (str): Input text containing URLs
+    
+    Returns:
+        str: Text with URLs replaced by their content
+    """
+    return "".join(await get_content_segments(text))
+
+def get_complete_content(text: str) -> str:
+    """
+    Synchronous wrapper around get_complete_content_async for callers without an event loop.
+    """
+    return asyncio.run(get_complete_content_async(text))
 
 if __name__ == "__main__":
     # Test the function
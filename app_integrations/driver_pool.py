@@ -0,0 +1,194 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Warm browsers kept per process, and pages a browser serves before it's
+# replaced (long-lived Chrome sessions slowly leak memory)
+SELENIUM_POOL_SIZE = int(os.getenv("SELENIUM_POOL_SIZE", "2"))
+SELENIUM_MAX_PAGES_PER_DRIVER = int(os.getenv("SELENIUM_MAX_PAGES_PER_DRIVER", "50"))
+
+
+@dataclass
+class PooledDriver:
+    driver: Any
+    pages: int = 0
+
+
+class DriverPool:
+    """
+    Thread-safe pool of warm Selenium drivers.
+
+    At most `size` drivers exist at once; callers beyond that wait for one to
+    be returned. A driver is quit and replaced after `max_pages` pages, as
+    soon as it stops responding after a failed scrape, or when the scrape
+    raised one of `discard_on` (e.g. a page-load timeout, after which the
+    browser may still be busy with the page).
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int = SELENIUM_POOL_SIZE,
+        max_pages: int = SELENIUM_MAX_PAGES_PER_DRIVER,
+        discard_on: Tuple[type, ...] = (),
+    ):
+        self.factory = factory
+        self.max_pages = max_pages
+        self.discard_on = discard_on
+        self._idle: "queue.LifoQueue[PooledDriver]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.recycled = 0
+        self.crashed = 0
+        self.timed_out = 0
+
+    def _checkout(self) -> PooledDriver:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            driver = self.factory()
+            with self._lock:
+                self.created += 1
+            return PooledDriver(driver)
+
+    @staticmethod
+    def _is_alive(driver) -> bool:
+        try:
+            driver.title
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(driver):
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Error quitting Selenium driver: {str(e)}")
+
+    @contextmanager
+    def driver(self, timeout: Optional[float] = None):
+        """
+        Borrow a warm driver for one page.
+
+        Args:
+            timeout (float): Seconds to wait for a free driver; None waits indefinitely
+
+        Yields:
+            WebDriver: A driver that must not be used after the block exits
+
+        Raises:
+            TimeoutError: If no driver became free within timeout
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No Selenium driver free within {timeout:.1f}s")
+        try:
+            entry = self._checkout()
+            healthy = True
+            timed_out = False
+            try:
+                yield entry.driver
+            except self.discard_on:
+                healthy = False
+                timed_out = True
+                raise
+            except Exception:
+                healthy = self._is_alive(entry.driver)
+                raise
+            finally:
+                entry.pages += 1
+                if healthy and entry.pages < self.max_pages:
+                    self._idle.put(entry)
+                else:
+                    with self._lock:
+                        if timed_out:
+                            self.timed_out += 1
+                        elif healthy:
+                            self.recycled += 1
+                        else:
+                            self.crashed += 1
+                    self._quit(entry.driver)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                entry = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._quit(entry.driver)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "created": self.created,
+                "recycled": self.recycled,
+                "crashed": self.crashed,
+                "timed_out": self.timed_out,
+                "idle": self._idle.qsize()
+            }
+
+
+def create_pool(factory: Callable[[], Any], **kwargs) -> DriverPool:
+    # Pools created through here quit their browsers when the process exits
+    pool = DriverPool(factory, **kwargs)
+    atexit.register(pool.close)
+    return pool
+
+
+if __name__ == "__main__":
+    # Per-URL latency of scrape_webpage with a fresh browser per URL (the old
+    # behaviour) versus the warm pool, against pages served locally.
+    import statistics
+    import sys
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app_integrations.content_middleware import scrape_webpage
+
+    page_count = 10
+
+    class PageHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = (
+                "<html><head><style>p {color: black}</style></head><body>"
+                "<nav>Home | About</nav>"
+                f"<article><h1>Post {self.path}</h1>" + "<p>Some article text.</p>" * 50 + "</article>"
+                "<footer>Footer</footer><script>var x = 1;</script></body></html>"
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls = [f"http://127.0.0.1:{server.server_address[1]}/post-{i}" for i in range(page_count)]
+
+    print(f"Scraping {page_count} local pages")
+    print("-" * 50)
+    for label, use_pool in [("Without pool", False), ("With pool", True)]:
+        latencies = []
+        for url in urls:
+            started = time.perf_counter()
+            scrape_webpage(url, use_pool=use_pool)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"{label}: mean {statistics.mean(latencies):.0f}ms, "
+              f"first {latencies[0]:.0f}ms, median {statistics.median(latencies):.0f}ms, max {max(latencies):.0f}ms")
+
+    server.shutdown()
@@ -0,0 +1,288 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# Pages are fetched with a plain GET first; anything that looks JS-rendered or
+# yields less than HTTP_MIN_CONTENT_CHARS of text is handed to the browser tier
+HTTP_FETCH_TIMEOUT_SECONDS = float(os.getenv("HTTP_FETCH_TIMEOUT_SECONDS", "10"))
+HTTP_FETCH_MAX_BYTES = int(os.getenv("HTTP_FETCH_MAX_BYTES", str(5 * 1024 * 1024)))
+HTTP_MIN_CONTENT_CHARS = int(os.getenv("HTTP_MIN_CONTENT_CHARS", "500"))
+# Characters of a page that are parsed (on a worker thread, ~1s per MB); the
+# main content of a longer page is almost always within them
+HTTP_PARSE_MAX_CHARS = int(os.getenv("HTTP_PARSE_MAX_CHARS", str(1024 * 1024)))
+
+HTTP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml;q=0.9,text/plain;q=0.8,*/*;q=0.5",
+}
+
+# Void elements never get an end tag, so they're never pushed on the stack
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+# Never rendered as text by a browser either
+HIDDEN_TAGS = {'head', 'noscript', 'template', 'svg'}
+
+# Signs of a page that renders its content client-side
+JS_RENDERED_MARKERS = re.compile(
+    r'enable javascript|javascript is required|requires javascript|'
+    r'<div[^>]+id=["\'](?:root|app|__next|__nuxt)["\'][^>]*>\s*</div>',
+    re.IGNORECASE
+)
+
+
+def parse_selector(selector: str) -> Tuple[str, str]:
+    # Only the simple selectors used by content_middleware: tag, .class and #id
+    if selector.startswith('.'):
+        return 'class', selector[1:]
+    if selector.startswith('#'):
+        return 'id', selector[1:]
+    return 'tag', selector.lower()
+
+
+class MainContentParser(HTMLParser):
+    """
+    Collects the text of an HTML document the way scrape_webpage's injected
+    script does: unwanted tags are dropped, and text is gathered both for the
+    body and for every element matching each content selector.
+    """
+
+    def __init__(self, selectors: List[str], unwanted_tags: List[str]):
+        super().__init__(convert_charrefs=True)
+        self.selectors = [parse_selector(selector) for selector in selectors]
+        self.skipped_tags = set(unwanted_tags) | HIDDEN_TAGS
+        self.body_text: List[str] = []
+        self.selector_text: List[List[str]] = [[] for _ in selectors]
+        self.selector_matched = [False] * len(selectors)
+
+        # Each open element: (tag, indexes of selectors it matches, skipped)
+        self._stack: List[Tuple[str, List[int], bool]] = []
+        self._open_matches = [0] * len(selectors)
+        self._skip_depth = 0
+
+    def _matches(self, tag: str, attrs: Dict[str, str]) -> List[int]:
+        classes = (attrs.get('class') or '').split()
+        element_id = attrs.get('id')
+        matched = []
+        for index, (kind, value) in enumerate(self.selectors):
+            if (kind == 'tag' and tag == value) or (kind == 'class' and value in classes) \
+                    or (kind == 'id' and element_id == value):
+                matched.append(index)
+        return matched
+
+    def handle_starttag(self, tag, attrs):
+        if tag in VOID_TAGS:
+            return
+
+        skipped = tag in self.skipped_tags
+        matched = [] if self._skip_depth or skipped else self._matches(tag, dict(attrs))
+        self._stack.append((tag, matched, skipped))
+
+        if skipped:
+            self._skip_depth += 1
+        for index in matched:
+            self._open_matches[index] += 1
+            self.selector_matched[index] = True
+
+    def handle_endtag(self, tag):
+        # Tolerate unclosed elements by popping up to the matching start tag
+        if not any(open_tag == tag for open_tag, _, _ in self._stack):
+            return
+        while self._stack:
+            open_tag, matched, skipped = self._stack.pop()
+            if skipped:
+                self._skip_depth -= 1
+            for index in matched:
+                self._open_matches[index] -= 1
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self._skip_depth or not data.strip():
+            return
+        self.body_text.append(data)
+        for index, count in enumerate(self._open_matches):
+            if count:
+                self.selector_text[index].append(data)
+
+
+def extract_main_content(html: str, selectors: List[str], unwanted_tags: List[str]) -> str:
+    """
+    Extract readable text from HTML, preferring the first content selector
+    that matches and falling back to the whole body.
+
+    Args:
+        html (str): Page source
+        selectors (List[str]): Content selectors, in priority order
+        unwanted_tags (List[str]): Tags whose text is dropped
+
+    Returns:
+        str: Whitespace-normalized text
+    """
+    parser = MainContentParser(selectors, unwanted_tags)
+    parser.feed(html)
+    parser.close()
+
+    content = ""
+    for index, matched in enumerate(parser.selector_matched):
+        if matched:
+            content = " ".join(parser.selector_text[index])
+            break
+
+    if not content.strip():
+        content = " ".join(parser.body_text)
+
+    return re.sub(r'\s+', ' ', content).strip()
+
+
+def extract_page_text(html: str, content_type: str, selectors: List[str], unwanted_tags: List[str]) -> Optional[str]:
+    """
+    Text of a fetched page, or None if it looks rendered client-side.
+    CPU-bound: run it off the event loop.
+    """
+    html = html[:HTTP_PARSE_MAX_CHARS]
+    if content_type.startswith("text/plain"):
+        return re.sub(r'\s+', ' ', html).strip()
+    if JS_RENDERED_MARKERS.search(html):
+        return None
+    return extract_main_content(html, selectors, unwanted_tags)
+
+
+class TierStats:
+    """
+    Per-tier usage counts and latency for the tiered web fetcher, plus the
+    reasons pages were sent on to the browser tier.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers: Dict[str, dict] = {}
+        self._fallbacks: Dict[str, int] = {}
+
+    def record(self, tier: str, elapsed_ms: float, served: bool):
+        with self._lock:
+            entry = self._tiers.setdefault(tier, {"attempts": 0, "served": 0, "total_ms": 0.0, "max_ms": 0.0})
+            entry["attempts"] += 1
+            entry["served"] += int(served)
+            entry["total_ms"] += elapsed_ms
+            entry["max_ms"] = max(entry["max_ms"], elapsed_ms)
+
+    def record_fallback(self, reason: str):
+        with self._lock:
+            self._fallbacks[reason] = self._fallbacks.get(reason, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            tiers = {
+                tier: {
+                    **entry,
+                    "total_ms": round(entry["total_ms"], 2),
+                    "max_ms": round(entry["max_ms"], 2),
+                    "avg_ms": round(entry["total_ms"] / entry["attempts"], 2) if entry["attempts"] else 0.0
+                }
+                for tier, entry in self._tiers.items()
+            }
+            return {"tiers": tiers, "fallbacks": dict(self._fallbacks)}
+
+
+def create_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        headers=HTTP_HEADERS,
+        follow_redirects=True,
+        timeout=HTTP_FETCH_TIMEOUT_SECONDS
+    )
+
+
+@dataclass
+class StaticFetch:
+    """
+    Outcome of the plain HTTP tier.
+
+    text is set when the page was usable as is; otherwise fallback_reason says
+    why the browser tier is needed. not_modified means the origin answered a
+    conditional request with 304. etag and last_modified are the response
+    validators, kept for revalidating a cached copy later.
+    """
+    text: Optional[str] = None
+    fallback_reason: Optional[str] = None
+    not_modified: bool = False
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+async def fetch_static(client: httpx.AsyncClient, url: str, selectors: List[str], unwanted_tags: List[str],
+                       etag: Optional[str] = None, last_modified: Optional[str] = None) -> StaticFetch:
+    """
+    Fetch a page with a plain HTTP GET and extract its main content.
+
+    Args:
+        etag, last_modified: Validators of a cached copy; when given the
+            request is conditional and may come back not_modified
+
+    Returns:
+        StaticFetch: The extracted text or the reason to fall back
+    """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    try:
+        async with client.stream("GET", url, headers=headers) as response:
+            validators = {
+                "etag": response.headers.get("etag"),
+                "last_modified": response.headers.get("last-modified")
+            }
+            if response.status_code == 304:
+                return StaticFetch(not_modified=True, **validators)
+            if response.status_code >= 400:
+                return StaticFetch(fallback_reason="http_error")
+
+            content_type = response.headers.get("content-type", "").lower()
+            if content_type and "html" not in content_type and not content_type.startswith("text/"):
+                return StaticFetch(fallback_reason="not_html", **validators)
+
+            body = bytearray()
+            async for part in response.aiter_bytes():
+                body.extend(part)
+                if len(body) > HTTP_FETCH_MAX_BYTES:
+                    return StaticFetch(fallback_reason="too_large", **validators)
+            html = body.decode(response.charset_encoding or "utf-8", errors="replace")
+    except httpx.HTTPError:
+        return StaticFetch(fallback_reason="http_error")
+
+    text = await asyncio.to_thread(extract_page_text, html, content_type, selectors, unwanted_tags)
+    if text is None:
+        return StaticFetch(fallback_reason="js_rendered", **validators)
+
+    if len(text) < HTTP_MIN_CONTENT_CHARS:
+        return StaticFetch(fallback_reason="short_text", **validators)
+    return StaticFetch(text=text, **validators)
+
+
+if __name__ == "__main__":
+    # Compare HTTP-tier extraction with what the browser script would keep
+    sample = """
+    <html><head><title>Post</title><style>p {color: red}</style></head>
+    <body>
+      <header>Site header</header><nav>Home | About</nav>
+      <div class="content">Sidebar-ish content</div>
+      <article><h1>Title</h1><p>First paragraph.<br>Second line.</p><script>var x = 1;</script></article>
+      <footer>Footer</footer>
+    </body></html>
+    """
+    selectors = ["article", "main", ".content", "#content", ".post-content", ".article-content"]
+    unwanted = ['script', 'style', 'nav', 'footer', 'header']
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        text = extract_main_content(sample, selectors, unwanted)
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"Extracted: {text!r}")
+    print(f"{elapsed / 1000:.3f}ms per page")
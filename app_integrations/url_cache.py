@@ -0,0 +1,168 @@
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+# Extracted URL content is cached on disk so it survives restarts and is
+# shared by every user who submits the same link. Web pages are served from
+# the cache for URL_CACHE_PAGE_TTL_SECONDS, then revalidated with their
+# ETag/Last-Modified; transcripts don't change, so they're kept until evicted.
+URL_CACHE_PATH = os.getenv(
+    "URL_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "url_cache.sqlite3")
+)
+URL_CACHE_MAX_BYTES = int(os.getenv("URL_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+URL_CACHE_PAGE_TTL_SECONDS = int(os.getenv("URL_CACHE_PAGE_TTL_SECONDS", str(6 * 3600)))
+
+# Query parameters that never change what a page shows
+TRACKING_PARAMS = {'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ref', 'ref_src', 'si'}
+
+
+def normalize_url(url: str, video_id: Optional[str] = None) -> str:
+    """
+    Cache key for a URL.
+
+    YouTube links are keyed by video id so youtu.be and youtube.com forms of
+    the same video share an entry. Other URLs get a lowercase scheme and host,
+    no fragment, default port or trailing slash, and sorted query parameters
+    without tracking parameters.
+    """
+    if video_id:
+        return f"youtube:{video_id}"
+
+    parsed = urlparse(url.strip())
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or '').lower()
+    if parsed.port and not (scheme, parsed.port) in (('http', 80), ('https', 443)):
+        host = f"{host}:{parsed.port}"
+
+    path = parsed.path or '/'
+    if len(path) > 1:
+        path = path.rstrip('/')
+
+    query = sorted(
+        (name, value) for name, value in parse_qsl(parsed.query, keep_blank_values=True)
+        if not name.lower().startswith('utm_') and name.lower() not in TRACKING_PARAMS
+    )
+    return urlunparse((scheme, host, path, '', urlencode(query), ''))
+
+
+@dataclass
+class CachedContent:
+    content: str
+    kind: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: Optional[float]
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires_at is None or self.expires_at > time.time()
+
+
+class URLContentCache:
+    """
+    SQLite-backed cache of extracted URL content, bounded by total content
+    size with least-recently-used eviction.
+    """
+
+    def __init__(self, path: str = URL_CACHE_PATH, max_bytes: int = URL_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "create table if not exists url_content ("
+            " key text primary key, kind text not null, content text not null,"
+            " etag text, last_modified text, expires_at real,"
+            " size integer not null, accessed_at real not null)"
+        )
+        self._db.execute("create index if not exists idx_url_content_accessed_at on url_content(accessed_at)")
+        self._db.commit()
+        self._size = self._db.execute("select coalesce(sum(size), 0) from url_content").fetchone()[0]
+
+        self.hits = 0
+        self.stale = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[CachedContent]:
+        """
+        Look up an entry, fresh or stale. Callers decide whether a stale
+        entry needs revalidation.
+        """
+        with self._lock:
+            row = self._db.execute(
+                "select content, kind, etag, last_modified, expires_at from url_content where key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._db.execute("update url_content set accessed_at = ? where key = ?", (time.time(), key))
+            self._db.commit()
+            entry = CachedContent(*row)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+            return entry
+
+    def put(self, key: str, kind: str, content: str, etag: Optional[str] = None,
+            last_modified: Optional[str] = None, ttl_seconds: Optional[int] = None):
+        now = time.time()
+        size = len(content.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._db.execute("select size from url_content where key = ?", (key,)).fetchone()
+            self._db.execute(
+                "insert or replace into url_content (key, kind, content, etag, last_modified, expires_at, size, accessed_at)"
+                " values (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, kind, content, etag, last_modified, now + ttl_seconds if ttl_seconds is not None else None, size, now)
+            )
+            self._size += size - (previous[0] if previous else 0)
+            self._evict()
+            self._db.commit()
+
+    def renew(self, key: str, ttl_seconds: int):
+        # The origin confirmed the cached copy (304), so serve it for another TTL
+        with self._lock:
+            self._db.execute(
+                "update url_content set expires_at = ?, accessed_at = ? where key = ?",
+                (time.time() + ttl_seconds, time.time(), key)
+            )
+            self._db.commit()
+            self.revalidated += 1
+
+    def _evict(self):
+        # Caller holds the lock; drop least recently used entries until under the bound
+        while self._size > self.max_bytes:
+            rows = self._db.execute(
+                "select key, size from url_content order by accessed_at limit 100"
+            ).fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._db.execute("delete from url_content where key = ?", (key,))
+                self._size -= size
+                self.evictions += 1
+                if self._size <= self.max_bytes:
+                    break
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._db.execute("select count(*) from url_content").fetchone()[0]
+            return {
+                "hits": self.hits,
+                "stale": self.stale,
+                "revalidated": self.revalidated,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": entries,
+                "bytes": self._size
+            }
@@ -1,11 +1,84 @@
 import voyageai
 import anthropic
+import logging
 import os
+import threading
 from dotenv import load_dotenv
+from embedding_batcher import EmbeddingBatcher
+from chunker import count_tokens, iter_chunks, CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS
+from context_builder import drop_repeated, sentence_keys
+from embedding_cache import EmbeddingCache, make_key
+from retrieval_cache import normalize_query
+from metrics import stage
+from structured_logging import log_event
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Cap on a conversation's rolling summary, which is sent with every turn
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+# Anthropic doesn't cache prompt prefixes shorter than this (Claude 3.5 Sonnet)
+PROMPT_CACHE_MIN_TOKENS = 1024
+# count_tokens uses the chunking tokenizer (or an approximation), not Claude's,
+# so a prefix is only marked for caching once it clears the minimum by this factor
+PROMPT_CACHE_TOKEN_MARGIN = 1.25
+
+# Shared by every persona; kept byte-identical so it stays a cacheable prefix
+PERSONA_INSTRUCTIONS = (
+    "You are an agent mirroring a person. Reply to the user's message as that person would, "
+    "based on the person's context.\n"
+    "Generate only the reply, no other text.\n"
+    'For example, if the message is "What do you like?", the reply should be "I like apples."'
+)
+
+
+class LLMUsage:
+    """
+    Running totals of Anthropic token usage, split into uncached input,
+    prompt-cache writes and prompt-cache reads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.totals = {
+            "input_tokens": 0,
+            "cache_creation_input_tokens": 0,
+            "cache_read_input_tokens": 0,
+            "output_tokens": 0
+        }
+
+    def record(self, usage) -> dict:
+        """
+        Add one response's usage to the totals.
+
+        Returns:
+            dict: That response's token counts
+        """
+        counts = {name: getattr(usage, name, None) or 0 for name in self.totals}
+        with self._lock:
+            self.requests += 1
+            for name, count in counts.items():
+                self.totals[name] += count
+        log_event(logger, logging.INFO, "llm_usage", **counts)
+        return counts
+
+    def stats(self) -> dict:
+        with self._lock:
+            totals = dict(self.totals)
+            requests = self.requests
+        prompt_tokens = totals["input_tokens"] + totals["cache_creation_input_tokens"] + totals["cache_read_input_tokens"]
+        return {
+            "requests": requests,
+            **totals,
+            "cache_read_share": round(totals["cache_read_input_tokens"] / prompt_tokens, 4) if prompt_tokens else 0.0,
+            # Cache reads are billed at 10% of base input price and writes at 125%
+            "input_tokens_saved": round(0.9 * totals["cache_read_input_tokens"] - 0.25 * totals["cache_creation_input_tokens"])
+        }
+
 class AIClient:
     def __init__(self):
         # Initialize Voyage AI client
@@ -16,72 +89,241 @@ class AIClient:
         anthropic_api_key = os.getenv("ANTHROPIC_API_KEY")
         self.anthropic_client = anthropic.Anthropic(api_key=anthropic_api_key)
 
-    def split_content(self, content: str, max_length: int) -> list:
-        # Split content into chunks of max_length
-        return [content[i:i+max_length] for i in range(0, len(content), max_length)]
+        # Groups document chunks into provider-sized requests and embeds them concurrently
+        self.embedding_batcher = EmbeddingBatcher(self._embed_documents)
 
-    def generate_embeddings(self, content: str):
-        try:
-            # Define the maximum length for each chunk
-            max_length = 4000  # Example length, adjust based on model's context length
+        # Content-hash cache so re-synced or re-posted text isn't embedded again
+        self.embedding_cache = EmbeddingCache()
 
-            # Split content into manageable chunks
-            chunks = self.split_content(content, max_length)
-            embeddings = []
+        # Token usage of LLM calls, including prompt-cache reads and writes
+        self.llm_usage = LLMUsage()
 
-            for chunk in chunks:
-                # Generate embeddings for each chunk
-                result = self.voyage_client.embed(
-                    texts=[chunk],
-                    model="voyage-3-lite",
-                    input_type="document"
-                )
-                embeddings.append(result.embeddings[0])
+    def _embed_documents(self, texts: list) -> list:
+        with stage("embed"):
+            result = self.voyage_client.embed(
+                texts=texts,
+                model="voyage-3-lite",
+                input_type="document"
+            )
+        return result.embeddings
+
+    def embed_documents(self, chunks: list) -> list:
+        # Only chunks missing from the cache (deduplicated) are sent to Voyage
+        keys = [make_key("voyage-3-lite", "document", chunk) for chunk in chunks]
+        cached = self.embedding_cache.get_many(keys)
+
+        pending = {}
+        for chunk, key in zip(chunks, keys):
+            if key not in cached and key not in pending:
+                pending[key] = chunk
+
+        if pending:
+            fresh = self.embedding_batcher.embed(list(pending.values()))
+            new_entries = dict(zip(pending.keys(), fresh))
+            self.embedding_cache.put_many(new_entries)
+            cached.update(new_entries)
+
+        log_event(logger, logging.DEBUG, "embedding_cache", chunks=len(chunks), cached=len(chunks) - len(pending))
+        return [cached[key] for key in keys]
+
+    def split_content(self, content: str, max_tokens: int = CHUNK_MAX_TOKENS, overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> list:
+        # Split content on paragraph/sentence boundaries into chunks of about max_tokens
+        return list(iter_chunks(content, max_tokens, overlap_tokens))
+
+    def generate_embeddings(self, content):
+        try:
+            # Split content into token-sized chunks; a list of segments is split segment by segment
+            segments = [content] if isinstance(content, str) else content
+            chunks = [chunk for segment in segments for chunk in self.split_content(segment)]
+
+            # Generate embeddings in batches; results are in chunk order
+            embeddings = self.embed_documents(chunks)
 
             # Print the number of embeddings generated
-            print(f"Generated {len(embeddings)} embeddings")
+            log_event(logger, logging.DEBUG, "embeddings_generated", count=len(embeddings))
             return chunks, embeddings
 
-        except Exception as e:
-            print(f"Error generating embeddings: {e}")
+        except Exception:
+            logger.exception("Error generating embeddings")
             return None, None
 
+    def embed_query(self, query: str):
+        # Repeated chat questions reuse their embedding; case and punctuation don't matter
+        key = make_key("voyage-3-lite", "query", normalize_query(query))
+        cached = self.embedding_cache.get_many([key])
+        if key in cached:
+            return cached[key]
+
+        try:
+            # Queries use input_type="query" so they land in the same space as stored chunks
+            with stage("embed"):
+                result = self.voyage_client.embed(
+                    texts=[query],
+                    model="voyage-3-lite",
+                    input_type="query"
+                )
+            self.embedding_cache.put_many({key: result.embeddings[0]})
+            return result.embeddings[0]
+        except Exception:
+            logger.exception("Error generating query embedding")
+            return None
+
+    def rerank_indices(self, documents: list, query: str, limit: int) -> list:
+        try:
+            # Same as rerank_documents, but returns (index, score) pairs so callers
+            # can map results back to the rows they came from
+            with stage("rerank"):
+                result = self.voyage_client.rerank(
+                    query=query,
+                    documents=documents,
+                    model="rerank-2-lite",
+                    top_k=limit
+                )
+            return [(item.index, item.relevance_score) for item in result.results]
+        except Exception:
+            logger.exception("Error reranking documents")
+            return []
+
     def rerank_documents(self, documents: list, query: str, limit: int) -> list:
         try:
             # Use the Voyager reranker to rank documents based on the query
-            result = self.voyage_client.rerank(
-                query=query,
-                documents=documents,
-                model="rerank-2-lite",
-                top_k=limit
-            )
+            with stage("rerank"):
+                result = self.voyage_client.rerank(
+                    query=query,
+                    documents=documents,
+                    model="rerank-2-lite",
+                    top_k=limit
+                )
             # Sort documents by their scores in descending order
             return [object.document for object in list(result.results)]
-        except Exception as e:
-            print(f"Error reranking documents: {e}")
+        except Exception:
+            logger.exception("Error reranking documents")
             return []
 
-    def generate_response_with_llm(self, query: str, documents: list) -> str:
+    def build_system(self, documents: list, summary: str = None, persona: str = None) -> list:
+        """
+        The instructions shared by every persona and the person's persona
+        text (see persona.PersonaPrefixes) are the same for every question to
+        that person. When together they surely reach PROMPT_CACHE_MIN_TOKENS
+        they end in a prompt-caching breakpoint, so later turns read them from
+        Anthropic's cache. The retrieved context changes with each question
+        and the conversation summary with each turn, so they follow uncached;
+        sentences of the context already in the persona text are left out.
+        """
+        system = [{"type": "text", "text": PERSONA_INSTRUCTIONS}]
+        if persona:
+            system.append({"type": "text", "text": f"About the person:\n\n{persona}"})
+            documents = drop_repeated(documents or [], sentence_keys([persona])).documents
+        prefix_tokens = count_tokens("\n".join(block["text"] for block in system))
+        if prefix_tokens >= PROMPT_CACHE_MIN_TOKENS * PROMPT_CACHE_TOKEN_MARGIN:
+            system[-1]["cache_control"] = {"type": "ephemeral"}
+        if documents:
+            context = "\n\n".join(documents)
+            system.append({"type": "text", "text": f"The person's context:\n\n{context}"})
+        if summary:
+            system.append({"type": "text", "text": f"Summary of the conversation so far:\n\n{summary}"})
+        return system
+
+    def build_messages(self, query: str, history: list = None) -> list:
+        # Recent turns, then the query, which is the only part new each turn.
+        # Consecutive messages from one side (e.g. a user message whose reply
+        # failed) are joined, since roles must alternate.
+        messages = []
+        for message in [*(history or []), {"role": "user", "content": query}]:
+            if messages and messages[-1]["role"] == message["role"]:
+                messages[-1] = {"role": message["role"], "content": f"{messages[-1]['content']}\n\n{message['content']}"}
+            else:
+                messages.append(message)
+        return messages
+
+    def summarize_conversation(self, summary: str, messages: list) -> str:
+        """
+        Fold older messages into a conversation's rolling summary with a small
+        model. The summary is capped at SUMMARY_MAX_TOKENS so it doesn't grow
+        with the conversation.
+
+        Args:
+            summary (str): The summary so far, or None
+            messages (list): Message rows (content, is_bot), oldest first
+
+        Returns:
+            str: The new summary, or None if the request failed
+        """
+        transcript = "\n".join(
+            f"{'Person' if message['is_bot'] else 'User'}: {message['content']}" for message in messages
+        )
+        prompt = (
+            f"Summary so far:\n{summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            "Rewrite the summary to include the new messages. Keep facts, names, questions and "
+            "commitments the person may need later; drop small talk. Reply with the summary only."
+        )
+        try:
+            with stage("summarize"):
+                message = self.anthropic_client.messages.create(
+                    model="claude-3-haiku-20240307",
+                    max_tokens=SUMMARY_MAX_TOKENS,
+                    messages=[{"role": "user", "content": prompt}]
+                )
+            return message.content[0].text.strip()
+        except Exception:
+            logger.exception("Error summarizing conversation")
+            return None
+
+    def generate_response_with_llm(self, query: str, documents: list, history=None, persona: str = None) -> str:
+        return self.generate_response_with_usage(query, documents, history, persona)[0]
+
+    def generate_response_with_usage(self, query: str, documents: list, history=None, persona: str = None) -> tuple:
+        """
+        Args:
+            history (History): Earlier turns of the conversation, if any
+            persona (str): The person's persona text, the cacheable part of the prompt
+
+        Returns:
+            tuple: The reply, and the Anthropic token usage as a dict (None if
+            the request failed and the reply is the fallback message)
+        """
         try:
-            # Prepare the input for the Anthropic LLM
-            retrieved_doc = "\n".join(documents)
-            prompt = f""" You are an agent mirroring a person. The person's context is '{retrieved_doc}'
-                Generate a response for {query}. 
-                Generate only the reply, no other text.
-                For example, if the query is "What do you like?", the reply should be "I like apples."
-            """
-            print(f"Prompt: {prompt}")
             # Use the Anthropic LLM to generate a response
-            message = self.anthropic_client.messages.create(
-                model="claude-3-5-sonnet-20240620",
-                max_tokens=1024,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            with stage("llm"):
+                message = self.anthropic_client.beta.prompt_caching.messages.create(
+                    model="claude-3-5-sonnet-20240620",
+                    max_tokens=1024,
+                    system=self.build_system(documents, history.summary if history else None, persona),
+                    messages=self.build_messages(query, history.messages if history else None)
+                )
 
             # Extract and return the generated response
-            return message.content[0].text.strip()
-        except Exception as e:
-            print(f"Error generating response with LLM: {e}")
-            return "I'm sorry, I couldn't generate a response at this time."
+            usage = self.llm_usage.record(message.usage)
+            return message.content[0].text.strip(), usage
+        except Exception:
+            logger.exception("Error generating response with LLM")
+            return "I'm sorry, I couldn't generate a response at this time.", None
+
+    def stream_response_with_llm(self, query: str, documents: list, usage: dict = None, history=None,
+                                 persona: str = None):
+        """
+        Stream the reply as text deltas as Anthropic produces them.
+        Yields the same fallback message as generate_response_with_llm if the
+        request fails before any text was produced. If a usage dict is given,
+        it's filled with the token usage once the stream completes.
+        """
+        produced = False
+        try:
+            # The stage covers the whole stream, first token to last
+            with stage("llm"), self.anthropic_client.beta.prompt_caching.messages.stream(
+                model="claude-3-5-sonnet-20240620",
+                max_tokens=1024,
+                system=self.build_system(documents, history.summary if history else None, persona),
+                messages=self.build_messages(query, history.messages if history else None)
+            ) as stream:
+                for text in stream.text_stream:
+                    produced = True
+                    yield text
+                recorded = self.llm_usage.record(stream.get_final_message().usage)
+                if usage is not None:
+                    usage.update(recorded)
+        except Exception:
+            logger.exception("Error streaming response with LLM")
+            if not produced:
+                yield "I'm sorry, I couldn't generate a response at this time."
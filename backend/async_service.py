@@ -0,0 +1,91 @@
+import asyncio
+import contextvars
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+# The Supabase, Voyage and Anthropic clients used by the backend are synchronous.
+# Endpoints offload every call to this pool so a slow request never blocks the
+# event loop. The pool bounds how many blocking calls run at once per worker.
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "32"))
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking-io")
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run a synchronous callable on the blocking I/O pool and await its result.
+    The caller's context variables (e.g. the request's trace) are visible to it.
+
+    Args:
+        func: Any blocking callable, e.g. a query builder's `execute`
+        *args, **kwargs: Passed through to func
+
+    Returns:
+        Whatever func returns; exceptions propagate to the caller
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, partial(context.run, func, *args, **kwargs))
+
+
+def shutdown(wait: bool = True):
+    """
+    Cancel queued calls and, with wait, let running ones finish. Called on
+    application shutdown, after the job queue has stopped submitting work.
+    """
+    _executor.shutdown(wait=wait, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    # Load test: async handlers calling a slow local stub server, first with
+    # the blocking call made inline (what the endpoints used to do), then
+    # offloaded through run_blocking.
+    import threading
+    import urllib.request
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    stub_latency = 0.1
+    concurrent_requests = 50
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(stub_latency)
+            body = b'{"ok": true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    stub_url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    def call_stub():
+        with urllib.request.urlopen(stub_url) as response:
+            return response.read()
+
+    async def inline_handler():
+        return call_stub()
+
+    async def offloaded_handler():
+        return await run_blocking(call_stub)
+
+    async def load(handler):
+        started = time.perf_counter()
+        await asyncio.gather(*(handler() for _ in range(concurrent_requests)))
+        return time.perf_counter() - started
+
+    print(f"Load test: {concurrent_requests} concurrent requests, stub latency {stub_latency * 1000:.0f}ms")
+    print("-" * 50)
+    for label, handler in [("Before (inline)", inline_handler), ("After (offloaded)", offloaded_handler)]:
+        elapsed = asyncio.run(load(handler))
+        print(f"{label}: {elapsed:.2f}s, {concurrent_requests / elapsed:.1f} req/s")
+
+    server.shutdown()
+    shutdown()
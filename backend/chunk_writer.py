@@ -0,0 +1,150 @@
+import hashlib
+import os
+from typing import Callable, Dict, Iterable, List, Optional
+
+from postgrest.types import ReturnMethod
+
+from ingest import INGEST_BATCH_SIZE, iter_chunk_batches
+from jobs import Job
+
+# Rows per upsert request; independent of how many chunks are embedded at once
+CHUNK_WRITE_BATCH_SIZE = int(os.getenv("CHUNK_WRITE_BATCH_SIZE", "200"))
+# Page size when reading a document's existing chunk hashes
+CHUNK_HASH_PAGE_SIZE = 1000
+
+
+def content_hash(content: str) -> str:
+    # Must match the backfill in 20241128000000_chunk_content_hash.sql
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class ChunkWriter:
+    """
+    Deduplicating bulk writer for the chunks table.
+
+    Every chunk is keyed by (document_id, sha256 of its content). Chunks a
+    document already has are not embedded or written again (only their
+    chunk_index is updated if they moved), new chunks are upserted in
+    batches, and chunks that are gone from a re-ingested document are
+    deleted in one statement at the end.
+    """
+
+    def __init__(self, supabase, batch_size: int = INGEST_BATCH_SIZE, write_batch_size: int = CHUNK_WRITE_BATCH_SIZE):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        self.write_batch_size = write_batch_size
+
+    def existing_chunks(self, document_id: str) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: chunk_index of each content hash already stored for the document
+        """
+        existing = {}
+        offset = 0
+        while True:
+            response = self.supabase.table('chunks')\
+                .select('content_hash, chunk_index')\
+                .eq('document_id', document_id)\
+                .order('id')\
+                .range(offset, offset + CHUNK_HASH_PAGE_SIZE - 1)\
+                .execute()
+            rows = response.data or []
+            for row in rows:
+                existing[row['content_hash']] = row['chunk_index']
+            if len(rows) < CHUNK_HASH_PAGE_SIZE:
+                return existing
+            offset += CHUNK_HASH_PAGE_SIZE
+
+    def upsert(self, rows: List[dict]):
+        for start in range(0, len(rows), self.write_batch_size):
+            self.supabase.table('chunks').upsert(
+                rows[start:start + self.write_batch_size],
+                on_conflict='document_id,content_hash',
+                returning=ReturnMethod.minimal
+            ).execute()
+
+    def ingest(
+        self,
+        document_id: str,
+        segments: Iterable[str],
+        embed_fn: Callable[[List[str]], List[list]],
+        job: Optional[Job] = None,
+        new_document: bool = False,
+        observer=None,
+    ) -> dict:
+        """
+        Chunk, embed and write a document's content, streaming one batch at a time.
+
+        Args:
+            document_id (str): Document the chunks belong to
+            segments: Texts chunked independently, in document order
+            embed_fn: Returns one embedding per chunk, in order
+            job (Job): Optional ingestion job whose progress is advanced per batch
+            new_document (bool): Skip looking up existing chunks for a document just created
+            observer: Optional listener (e.g. vector_index.IndexObserver) told about
+                rows added, moved and removed once they're written
+
+        Returns:
+            dict: rows_written (new chunks), rows_reindexed (kept chunks whose
+            position changed), rows_skipped (unchanged or repeated chunks) and
+            rows_deleted (stale chunks removed)
+        """
+        stats = {"rows_written": 0, "rows_reindexed": 0, "rows_skipped": 0, "rows_deleted": 0}
+        existing = {} if new_document else self.existing_chunks(document_id)
+        seen = set()
+        index = 0
+
+        for chunks, consumed in iter_chunk_batches(segments, self.batch_size):
+            fresh, moved = [], []
+            for chunk in chunks:
+                digest = content_hash(chunk)
+                if digest in seen:
+                    stats["rows_skipped"] += 1
+                    continue
+                seen.add(digest)
+
+                if digest not in existing:
+                    fresh.append((digest, chunk, index))
+                elif existing[digest] != index:
+                    moved.append({'document_id': document_id, 'content_hash': digest,
+                                  'content': chunk, 'chunk_index': index})
+                else:
+                    stats["rows_skipped"] += 1
+                index += 1
+
+            if fresh:
+                embeddings = embed_fn([chunk for _, chunk, _ in fresh])
+                if not embeddings or len(embeddings) != len(fresh):
+                    raise RuntimeError("Failed to generate embeddings")
+                rows = [
+                    {'document_id': document_id, 'content_hash': digest, 'content': chunk,
+                     'embeddings': embedding, 'chunk_index': chunk_index}
+                    for (digest, chunk, chunk_index), embedding in zip(fresh, embeddings)
+                ]
+                self.upsert(rows)
+                stats["rows_written"] += len(fresh)
+                if observer:
+                    observer.added(rows)
+
+            if moved:
+                # Only chunk_index changes; the stored embedding is kept
+                self.upsert(moved)
+                stats["rows_reindexed"] += len(moved)
+                if observer:
+                    observer.moved(moved)
+
+            if job:
+                job.advance(chunks_embedded=len(fresh), chunks_inserted=len(fresh) + len(moved),
+                            chunks_skipped=len(chunks) - len(fresh) - len(moved), bytes_processed=consumed)
+
+        stale = existing.keys() - seen
+        if stale:
+            response = self.supabase.rpc('delete_stale_chunks', {
+                'target_document_id': document_id,
+                'keep_hashes': list(seen)
+            }).execute()
+            stats["rows_deleted"] = response.data or 0
+            if observer:
+                observer.removed(document_id, stale)
+
+        return stats
@@ -0,0 +1,174 @@
+import os
+import re
+import time
+from functools import lru_cache
+from typing import Callable, Iterator, List, Optional, Tuple
+
+# Chunk sizes are in tokens of the embedding model, not characters
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "512"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "64"))
+CHUNK_TOKENIZER = os.getenv("CHUNK_TOKENIZER", "voyageai/voyage-3-lite")
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_WORD = re.compile(r'\S+')
+_APPROX_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+
+@lru_cache(maxsize=1)
+def _load_tokenizer():
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_pretrained(CHUNK_TOKENIZER)
+    except Exception as e:
+        # Offline or tokenizer unavailable: fall back to an approximate count
+        print(f"Error loading tokenizer {CHUNK_TOKENIZER}, using approximate token counts: {e}")
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count tokens with the embedding model's tokenizer, or approximate them
+    (one token per word or punctuation mark) if the tokenizer can't be loaded.
+    """
+    tokenizer = _load_tokenizer()
+    if tokenizer is not None:
+        return len(tokenizer.encode(text, add_special_tokens=False).ids)
+    return len(_APPROX_TOKEN.findall(text))
+
+
+def _iter_paragraphs(text: str) -> Iterator[str]:
+    # Walk paragraph breaks lazily; only one paragraph is sliced out at a time
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        paragraph = text[start:match.start()].strip()
+        if paragraph:
+            yield paragraph
+        start = match.end()
+    paragraph = text[start:].strip()
+    if paragraph:
+        yield paragraph
+
+
+def _split_words(text: str, max_tokens: int, counter: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    # Last resort for a single sentence longer than the budget
+    words = []
+    tokens = 0
+    for match in _WORD.finditer(text):
+        word = match.group()
+        word_tokens = counter(word)
+        if words and tokens + word_tokens > max_tokens:
+            yield " ".join(words), tokens
+            words, tokens = [], 0
+        words.append(word)
+        tokens += word_tokens
+    if words:
+        yield " ".join(words), tokens
+
+
+def _iter_units(text: str, max_tokens: int, counter: Callable[[str], int]) -> Iterator[Tuple[str, int, str]]:
+    """
+    Yield (text, tokens, separator) units no larger than max_tokens, preferring
+    whole paragraphs, then sentences, then word runs. separator is what joins
+    the unit to the one before it.
+    """
+    for paragraph in _iter_paragraphs(text):
+        tokens = counter(paragraph)
+        if tokens <= max_tokens:
+            yield paragraph, tokens, "\n\n"
+            continue
+
+        separator = "\n\n"
+        for sentence in _SENTENCE_END.split(paragraph):
+            sentence_tokens = counter(sentence)
+            if sentence_tokens <= max_tokens:
+                yield sentence, sentence_tokens, separator
+            else:
+                for words, word_tokens in _split_words(sentence, max_tokens, counter):
+                    yield words, word_tokens, separator
+                    separator = " "
+            separator = " "
+
+
+def iter_chunks(
+    text: str,
+    max_tokens: int = CHUNK_MAX_TOKENS,
+    overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+    counter: Optional[Callable[[str], int]] = None,
+) -> Iterator[str]:
+    """
+    Split text into chunks on paragraph and sentence boundaries.
+
+    Args:
+        text (str): Content to split
+        max_tokens (int): Target upper bound of tokens per chunk
+        overlap_tokens (int): Tokens of trailing units repeated at the start of the next chunk
+        counter (callable): Token counter, defaults to count_tokens
+
+    Yields:
+        str: Chunks in document order
+    """
+    counter = counter or count_tokens
+    overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    units: List[Tuple[str, int, str]] = []
+    total = 0
+    fresh = 0  # units not already emitted as part of the previous chunk
+
+    def render(parts):
+        return parts[0][0] + "".join(separator + unit for unit, _, separator in parts[1:])
+
+    for unit in _iter_units(text, max_tokens, counter):
+        if units and total + unit[1] > max_tokens:
+            if fresh:
+                yield render(units)
+
+            # Carry trailing units into the next chunk as overlap
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(units):
+                if carried_tokens + previous[1] > overlap_tokens or carried_tokens + previous[1] + unit[1] > max_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[1]
+            units, total, fresh = carried, carried_tokens, 0
+
+        units.append(unit)
+        total += unit[1]
+        fresh += 1
+
+    if units and fresh:
+        yield render(units)
+
+
+if __name__ == "__main__":
+    # Benchmark chunking throughput on a large synthetic document
+    import random
+
+    size_mb = int(os.getenv("CHUNK_BENCH_MB", "20"))
+    random.seed(0)
+    vocabulary = ["notion", "embedding", "mirror", "persona", "latency", "vector", "context", "the", "a", "of"]
+    paragraphs = []
+    written = 0
+    while written < size_mb * 1024 * 1024:
+        sentences = [
+            " ".join(random.choice(vocabulary) for _ in range(random.randint(5, 30))).capitalize() + "."
+            for _ in range(random.randint(1, 12))
+        ]
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        written += len(paragraph) + 2
+    text = "\n\n".join(paragraphs)
+
+    print(f"Chunking {len(text) / 1024 / 1024:.1f} MB of synthetic text...")
+    print("-" * 50)
+    for label, counter in [("approximate counter", lambda s: len(_APPROX_TOKEN.findall(s))), ("model tokenizer", None)]:
+        if counter is None and _load_tokenizer() is None:
+            print(f"{label}: skipped (tokenizer unavailable)")
+            continue
+        started = time.perf_counter()
+        chunks = 0
+        for chunk in iter_chunks(text, counter=counter):
+            chunks += 1
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {chunks} chunks in {elapsed:.2f}s ({len(text) / 1024 / 1024 / elapsed:.2f} MB/s)")
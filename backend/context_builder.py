@@ -0,0 +1,173 @@
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from chunker import count_tokens
+
+# Upper bound on retrieved context per prompt, in tokens. Counted with the
+# chunking tokenizer, which is close to (not exactly) the LLM's.
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Ranked chunks offered to the builder; the budget decides how many are used
+CONTEXT_MAX_CHUNKS = int(os.getenv("CONTEXT_MAX_CHUNKS", "8"))
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+@dataclass
+class Context:
+    """
+    Packed context for one prompt: the text of each used chunk, best first,
+    and counts for logging.
+    """
+    documents: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+def _sentence_key(sentence: str) -> str:
+    return " ".join(sentence.split())
+
+
+def sentence_keys(texts: List[str]) -> set:
+    """Normalized sentences of texts, for drop_repeated."""
+    return {
+        key
+        for text in texts
+        for paragraph in _PARAGRAPH_BREAK.split(text)
+        for key in map(_sentence_key, _SENTENCE_END.split(paragraph.strip()))
+        if key
+    }
+
+
+def drop_repeated(documents: List[str], seen: set) -> Context:
+    """
+    Remove sentences already elsewhere in the prompt (e.g. the persona text)
+    from packed context, keeping paragraph breaks. Documents left empty are
+    dropped.
+
+    Returns:
+        Context: The remaining texts and the number of sentences removed
+    """
+    kept = []
+    removed = 0
+    for document in documents:
+        paragraphs = []
+        for paragraph in _PARAGRAPH_BREAK.split(document):
+            sentences = []
+            for sentence in _SENTENCE_END.split(paragraph.strip()):
+                key = _sentence_key(sentence)
+                if key in seen:
+                    removed += 1
+                elif key:
+                    sentences.append(sentence)
+            if sentences:
+                paragraphs.append(" ".join(sentences))
+        if paragraphs:
+            kept.append("\n\n".join(paragraphs))
+    return Context(documents=kept, stats={"sentences_deduplicated": removed})
+
+
+def build_context(chunks: List[dict], budget: int = CONTEXT_TOKEN_BUDGET,
+                  counter: Optional[Callable[[str], int]] = None) -> Context:
+    """
+    Pack ranked chunks into a token budget.
+
+    Chunks are taken in rank order. Sentences already in the context (the
+    overlap between neighbouring chunks, or text repeated across documents)
+    are dropped, and a chunk that doesn't fit whole contributes the leading
+    sentences that do.
+
+    Args:
+        chunks (List[dict]): Ranked chunk rows with a 'content' key
+        budget (int): Maximum context tokens
+        counter (callable): Token counter, defaults to count_tokens
+
+    Returns:
+        Context: The texts to put in the prompt and packing stats
+    """
+    counter = counter or count_tokens
+    seen = set()
+    documents = []
+    used = 0
+    deduplicated = 0
+    truncated = 0
+
+    for chunk in chunks:
+        paragraphs = []
+        chunk_tokens = 0
+        full = True
+        for paragraph in _PARAGRAPH_BREAK.split(chunk['content']):
+            sentences = []
+            for sentence in _SENTENCE_END.split(paragraph.strip()):
+                key = _sentence_key(sentence)
+                if not key:
+                    continue
+                if key in seen:
+                    deduplicated += 1
+                    continue
+                tokens = counter(sentence)
+                if used + chunk_tokens + tokens > budget:
+                    full = False
+                    break
+                seen.add(key)
+                sentences.append(sentence)
+                chunk_tokens += tokens
+            if sentences:
+                paragraphs.append(" ".join(sentences))
+            if not full:
+                break
+
+        if paragraphs:
+            documents.append("\n\n".join(paragraphs))
+            used += chunk_tokens
+            truncated += not full
+        if used >= budget:
+            break
+
+    return Context(documents=documents, stats={
+        "context_chunks": len(documents),
+        "context_tokens": used,
+        "context_budget": budget,
+        "sentences_deduplicated": deduplicated,
+        "chunks_truncated": truncated
+    })
+
+
+if __name__ == "__main__":
+    # Prompt size before and after packing, for neighbouring chunks of one
+    # long document. Its paragraphs are short, so each chunk starts with the
+    # previous one's last paragraphs (the chunker's overlap). Chunks joined
+    # whole, as the prompt was built before, are compared with the same chunks
+    # deduplicated without a budget, and then packed into the default budget.
+    import random
+
+    from chunker import CHUNK_OVERLAP_TOKENS, iter_chunks
+
+    random.seed(0)
+    vocabulary = ["notion", "embedding", "mirror", "persona", "latency", "vector", "context", "the", "a", "of"]
+    text = "\n\n".join(
+        " ".join(
+            " ".join(random.choice(vocabulary) for _ in range(random.randint(5, 15))).capitalize() + "."
+            for _ in range(random.randint(1, 2))
+        )
+        for _ in range(400)
+    )
+    chunks = [{'content': chunk} for chunk in list(iter_chunks(text))[:CONTEXT_MAX_CHUNKS]]
+
+    def size(texts):
+        return count_tokens("\n".join(texts))
+
+    whole = size(chunk['content'] for chunk in chunks)
+    unbounded = build_context(chunks, budget=whole * 2)
+    deduplicated = size(unbounded.documents)
+    context = build_context(chunks)
+    packed = size(context.documents)
+
+    print(f"{len(chunks)} ranked chunks with {CHUNK_OVERLAP_TOKENS}-token overlap, joined whole: {whole} tokens")
+    print(f"Deduplicated, no budget: {deduplicated} tokens "
+          f"({unbounded.stats['sentences_deduplicated']} sentences, {whole - deduplicated} tokens saved)")
+    print(f"Packed into {CONTEXT_TOKEN_BUDGET}-token budget: {packed} tokens "
+          f"({deduplicated - packed} more tokens cut by the budget: {context.stats['chunks_truncated']} chunks "
+          f"truncated, {len(chunks) - context.stats['context_chunks']} left out)")
+    print(f"Budgeted stats: {context.stats}")
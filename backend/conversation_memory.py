@@ -0,0 +1,240 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from chunker import count_tokens
+from metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Messages sent verbatim with each prompt, newest first, bounded by count and
+# tokens. Older messages are folded into the conversation's rolling summary,
+# whose length the summarizer caps, so prompt size per turn stays constant.
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "8"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+# Active conversations kept in process; an idle one is reloaded after the TTL,
+# which also picks up turns handled by another worker
+CONVERSATION_CACHE_MAX_ENTRIES = int(os.getenv("CONVERSATION_CACHE_MAX_ENTRIES", "1000"))
+CONVERSATION_CACHE_TTL_SECONDS = int(os.getenv("CONVERSATION_CACHE_TTL_SECONDS", "600"))
+
+
+@dataclass
+class History:
+    """
+    What the LLM sees of a conversation before the current message: the
+    rolling summary of older turns and the most recent messages, oldest first,
+    as Anthropic message dicts.
+    """
+    summary: Optional[str] = None
+    messages: list = field(default_factory=list)
+
+
+@dataclass
+class ConversationState:
+    summary: Optional[str]
+    summary_message_id: Optional[int]
+    # Messages after the summary, oldest first: dicts with id, content, is_bot
+    messages: list
+    expires_at: float = 0.0
+    summarizing: bool = False
+
+
+class ConversationMemory:
+    """
+    Bounded per-conversation history for prompts.
+
+    A conversation is loaded with one query (its summary and last messages)
+    and then kept in an in-process LRU, to which each completed turn is
+    appended. Messages that no longer fit the window are summarized on a
+    background thread and the summary is stored on the conversation row, so
+    neither the prompt nor the load grows with conversation length.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        summarize: Callable[[Optional[str], List[dict]], Optional[str]],
+        max_messages: int = HISTORY_MAX_MESSAGES,
+        token_budget: int = HISTORY_TOKEN_BUDGET,
+        max_entries: int = CONVERSATION_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = CONVERSATION_CACHE_TTL_SECONDS,
+    ):
+        self.supabase = supabase
+        self.summarize = summarize
+        self.max_messages = max_messages
+        self.token_budget = token_budget
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._conversations: "OrderedDict[int, ConversationState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="conversation-summary")
+
+        self.hits = 0
+        self.loads = 0
+        self.summaries = 0
+        self.summary_errors = 0
+        self.messages_summarized = 0
+
+    def start(self, conversation_id: int):
+        """Track a conversation that was just created, without loading it."""
+        with self._lock:
+            self._store(int(conversation_id), ConversationState(None, None, []))
+
+    def history(self, conversation_id: int, query: str) -> History:
+        """
+        History to send with the current message. Blocking on a cache miss.
+
+        If the current message was already stored (and so was loaded with the
+        conversation), it's left out: the caller sends it as the query.
+        """
+        state = self._state(int(conversation_id))
+        with self._lock:
+            messages = list(state.messages)
+            summary = state.summary
+        if messages and not messages[-1]['is_bot'] and messages[-1]['content'] == query:
+            messages.pop()
+        recent = messages[self._window_start(messages):]
+        return History(summary=summary, messages=[
+            {"role": "assistant" if message['is_bot'] else "user", "content": message['content']}
+            for message in recent
+        ])
+
+    def record_turn(self, conversation_id: int, query: str, reply: str, reply_id: Optional[int]):
+        """
+        Append a completed turn and summarize whatever fell out of the window.
+        The summary is written in the background.
+        """
+        conversation_id = int(conversation_id)
+        with self._lock:
+            state = self._conversations.get(conversation_id)
+            if state is None:
+                # Not loaded here; the next turn loads it, reply included
+                return
+            messages = state.messages
+            if not (messages and not messages[-1]['is_bot'] and messages[-1]['content'] == query):
+                messages.append({'id': None, 'content': query, 'is_bot': False})
+            messages.append({'id': reply_id, 'content': reply, 'is_bot': True})
+            state.expires_at = time.time() + self.ttl_seconds
+            self._conversations.move_to_end(conversation_id)
+        self._schedule_summary(conversation_id, state)
+
+    def _state(self, conversation_id: int) -> ConversationState:
+        now = time.time()
+        with self._lock:
+            state = self._conversations.get(conversation_id)
+            if state is not None and state.expires_at > now:
+                self._conversations.move_to_end(conversation_id)
+                self.hits += 1
+                return state
+
+        state = self._load(conversation_id)
+        with self._lock:
+            self.loads += 1
+            current = self._conversations.get(conversation_id)
+            if current is not None and current.summarizing:
+                # A summary is being written for the old entry; keep it
+                current.expires_at = now + self.ttl_seconds
+                return current
+            self._store(conversation_id, state)
+        return state
+
+    def _load(self, conversation_id: int) -> ConversationState:
+        # The summary and the newest messages in one request
+        with stage("fetch_history"):
+            response = self.supabase.table('conversations')\
+                .select('summary, summary_message_id, messages(id, content, is_bot)')\
+                .eq('id', conversation_id)\
+                .order('id', desc=True, foreign_table='messages')\
+                .limit(self.max_messages + 1, foreign_table='messages')\
+                .execute()
+        row = response.data[0] if response.data else {}
+        summary_message_id = row.get('summary_message_id')
+        messages = [
+            message for message in reversed(row.get('messages') or [])
+            if summary_message_id is None or message['id'] > summary_message_id
+        ]
+        return ConversationState(row.get('summary'), summary_message_id, messages)
+
+    def _store(self, conversation_id: int, state: ConversationState):
+        # Caller holds the lock
+        state.expires_at = time.time() + self.ttl_seconds
+        self._conversations[conversation_id] = state
+        self._conversations.move_to_end(conversation_id)
+        while len(self._conversations) > self.max_entries:
+            self._conversations.popitem(last=False)
+
+    def _window_start(self, messages: list) -> int:
+        """Index of the oldest message sent verbatim."""
+        start = len(messages)
+        tokens = 0
+        while start > 0 and len(messages) - start < self.max_messages:
+            tokens += count_tokens(messages[start - 1]['content'])
+            if tokens > self.token_budget:
+                break
+            start -= 1
+        # The window starts on a user message, as Anthropic requires, so
+        # what's summarized always ends on a stored bot reply
+        while start < len(messages) and messages[start]['is_bot']:
+            start += 1
+        return start
+
+    def _schedule_summary(self, conversation_id: int, state: ConversationState):
+        with self._lock:
+            if state.summarizing or self._window_start(state.messages) == 0:
+                return
+            state.summarizing = True
+        self._executor.submit(self._summarize, conversation_id, state)
+
+    def _summarize(self, conversation_id: int, state: ConversationState):
+        try:
+            while True:
+                with self._lock:
+                    folded = state.messages[:self._window_start(state.messages)]
+                    previous = state.summary
+                if not folded:
+                    return
+
+                summary = self.summarize(previous, folded)
+                if not summary:
+                    self.summary_errors += 1
+                    return
+                summary_message_id = next(
+                    (message['id'] for message in reversed(folded) if message['id'] is not None),
+                    state.summary_message_id
+                )
+                self.supabase.table('conversations')\
+                    .update({'summary': summary, 'summary_message_id': summary_message_id})\
+                    .eq('id', conversation_id)\
+                    .execute()
+
+                with self._lock:
+                    # Only appends happened meanwhile, so the folded messages are still first
+                    del state.messages[:len(folded)]
+                    state.summary = summary
+                    state.summary_message_id = summary_message_id
+                    self.summaries += 1
+                    self.messages_summarized += len(folded)
+        except Exception as e:
+            self.summary_errors += 1
+            logger.error(f"Error summarizing conversation {conversation_id}: {e}")
+        finally:
+            with self._lock:
+                state.summarizing = False
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.loads
+            return {
+                "hits": self.hits,
+                "loads": self.loads,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "conversations": len(self._conversations),
+                "summaries": self.summaries,
+                "messages_summarized": self.messages_summarized,
+                "summary_errors": self.summary_errors
+            }
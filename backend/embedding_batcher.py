@@ -0,0 +1,141 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+from tenacity import Retrying, stop_after_attempt, wait_exponential
+
+# Per-request limits. Voyage accepts up to 1000 texts and 1M tokens per call for
+# voyage-3-lite; the defaults stay well below that so one slow batch doesn't
+# dominate a sync and a single failure only retries a modest amount of work.
+MAX_BATCH_TEXTS = int(os.getenv("EMBED_MAX_BATCH_TEXTS", "128"))
+MAX_BATCH_TOKENS = int(os.getenv("EMBED_MAX_BATCH_TOKENS", "100000"))
+MAX_CONCURRENCY = int(os.getenv("EMBED_MAX_CONCURRENCY", "4"))
+MAX_ATTEMPTS = int(os.getenv("EMBED_MAX_ATTEMPTS", "3"))
+
+
+def estimate_tokens(text: str) -> int:
+    # Conservative estimate (~3 characters per token) so batches never exceed the limit
+    return len(text) // 3 + 1
+
+
+class EmbeddingBatcher:
+    """
+    Groups texts into provider-sized batches and embeds them concurrently.
+
+    embed_fn takes a list of texts and returns one embedding per text, in order.
+    Failed batches are retried on their own; results come back in input order.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[list]],
+        max_batch_texts: int = MAX_BATCH_TEXTS,
+        max_batch_tokens: int = MAX_BATCH_TOKENS,
+        max_concurrency: int = MAX_CONCURRENCY,
+        max_attempts: int = MAX_ATTEMPTS,
+        token_counter: Callable[[str], int] = estimate_tokens,
+    ):
+        self.embed_fn = embed_fn
+        self.max_batch_texts = max_batch_texts
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.max_attempts = max_attempts
+        self.token_counter = token_counter
+
+    def plan_batches(self, texts: List[str]) -> List[range]:
+        """
+        Split texts into contiguous index ranges that respect both the text
+        count and token limits. A single text over the token limit gets its
+        own batch and is left to the provider to truncate or reject.
+        """
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = self.token_counter(text)
+            batch_size = index - start
+            if batch_size and (batch_size >= self.max_batch_texts or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(range(start, index))
+                start = index
+                batch_tokens = 0
+            batch_tokens += tokens
+        if start < len(texts):
+            batches.append(range(start, len(texts)))
+        return batches
+
+    def _embed_batch(self, texts: List[str]) -> List[list]:
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_attempts),
+            wait=wait_exponential(multiplier=0.5, max=8),
+            reraise=True
+        )
+        for attempt in retrying:
+            with attempt:
+                embeddings = self.embed_fn(texts)
+                if len(embeddings) != len(texts):
+                    raise ValueError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+                return embeddings
+
+    def embed(self, texts: List[str]) -> List[list]:
+        """
+        Embed texts in batches.
+
+        Returns:
+            List[list]: One embedding per input text, in input order
+
+        Raises:
+            Exception: The last error of a batch that failed every attempt
+        """
+        if not texts:
+            return []
+
+        batches = self.plan_batches(texts)
+        results: List[list] = [None] * len(texts)
+
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            for batch in batches:
+                results[batch.start:batch.stop] = self._embed_batch(texts[batch.start:batch.stop])
+            return results
+
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as executor:
+            futures = [
+                (batch, executor.submit(self._embed_batch, texts[batch.start:batch.stop]))
+                for batch in batches
+            ]
+            for batch, future in futures:
+                results[batch.start:batch.stop] = future.result()
+
+        return results
+
+
+if __name__ == "__main__":
+    # Benchmark against a local stub embedder that behaves like a remote API:
+    # fixed per-request latency plus a small per-text cost.
+    request_latency = 0.05
+    per_text_latency = 0.0005
+    dimensions = 512
+
+    def stub_embed(texts):
+        time.sleep(request_latency + per_text_latency * len(texts))
+        return [[float(len(text))] * dimensions for text in texts]
+
+    chunks = [f"chunk {i} " + "lorem ipsum dolor sit amet " * 140 for i in range(400)]
+
+    print("Benchmarking embedding throughput against a stub embedder...")
+    print("-" * 50)
+
+    started = time.perf_counter()
+    serial = [stub_embed([chunk])[0] for chunk in chunks]
+    serial_elapsed = time.perf_counter() - started
+    print(f"Serial:  {len(chunks)} chunks in {serial_elapsed:.2f}s ({len(chunks) / serial_elapsed:.1f} chunks/sec)")
+
+    batcher = EmbeddingBatcher(stub_embed)
+    started = time.perf_counter()
+    batched = batcher.embed(chunks)
+    batched_elapsed = time.perf_counter() - started
+    batches = len(batcher.plan_batches(chunks))
+    print(f"Batched: {len(chunks)} chunks in {batched_elapsed:.2f}s ({len(chunks) / batched_elapsed:.1f} chunks/sec, {batches} requests)")
+
+    assert batched == serial, "Batched embeddings must match serial order"
+    print(f"Speedup: {serial_elapsed / batched_elapsed:.1f}x")
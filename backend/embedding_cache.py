@@ -0,0 +1,135 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# In-process tier limits. Embeddings are held as float32 arrays (~2 KB each for
+# voyage-3-lite), so the default bounds this tier at roughly 40 MB.
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "20000"))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", str(24 * 3600)))
+# Optional SQLite file for the persistent tier; unset disables it
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+
+def normalize_text(text: str) -> str:
+    # Whitespace-only differences shouldn't cost a new embedding
+    return " ".join(text.split())
+
+
+def make_key(model: str, input_type: str, text: str) -> str:
+    payload = f"{model}\0{input_type}\0{normalize_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache keyed by hash(model, input_type, normalized text).
+
+    The first tier is an in-process LRU with size and TTL limits. The optional
+    second tier is a SQLite table; embeddings are deterministic for a given
+    key, so persisted entries don't expire.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = EMBEDDING_CACHE_TTL_SECONDS,
+        path: Optional[str] = EMBEDDING_CACHE_PATH,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, array]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "create table if not exists embeddings (key text primary key, embedding blob not null, created_at real not null)"
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, vector: array, now: float):
+        # Caller holds the lock
+        self._entries[key] = (now + self.ttl_seconds, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        Look up keys in both tiers.
+
+        Returns:
+            Dict[str, List[float]]: Embeddings for the keys that were found
+        """
+        found = {}
+        missing = []
+        now = time.time()
+
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1].tolist()
+                    self.hits += 1
+                else:
+                    if entry:
+                        del self._entries[key]
+                    missing.append(key)
+
+            if missing and self._db is not None:
+                for start in range(0, len(missing), 500):
+                    batch = missing[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    rows = self._db.execute(
+                        f"select key, embedding from embeddings where key in ({placeholders})", batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = array("f")
+                        vector.frombytes(blob)
+                        self._remember(key, vector, now)
+                        found[key] = vector.tolist()
+                        self.persistent_hits += 1
+
+            self.misses += len(missing) - sum(1 for key in missing if key in found)
+
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            vectors = {key: array("f", embedding) for key, embedding in items.items()}
+            for key, vector in vectors.items():
+                self._remember(key, vector, now)
+
+            if self._db is not None and vectors:
+                self._db.executemany(
+                    "insert or replace into embeddings (key, embedding, created_at) values (?, ?, ?)",
+                    [(key, vector.tobytes(), now) for key, vector in vectors.items()]
+                )
+                self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.persistent_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "persistent": self._db is not None
+            }
@@ -0,0 +1,117 @@
+import os
+from typing import Iterable, Iterator, List, Tuple
+
+from chunker import iter_chunks
+
+# Chunks embedded and inserted together. Only one batch of chunks, embeddings
+# and records is alive at a time, so memory use doesn't grow with the input.
+# 256 records of 512-dim vectors keep each insert request around 2-3 MB.
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "256"))
+
+
+def utf8_length(text: str, block: int = 1 << 20) -> int:
+    # Encode a block at a time so measuring a huge string doesn't copy it whole
+    return sum(len(text[start:start + block].encode('utf-8')) for start in range(0, len(text), block))
+
+
+def iter_chunk_batches(segments: Iterable[str], batch_size: int = INGEST_BATCH_SIZE) -> Iterator[Tuple[List[str], int]]:
+    """
+    Lazily chunk segments and group the chunks into batches.
+
+    Each segment is chunked on its own. Bytes processed are estimated from the
+    chunk sizes (capped at the segment's size, since chunks overlap) and
+    settled exactly when a segment ends.
+
+    Yields:
+        Tuple[List[str], int]: A batch of chunks, and input bytes consumed since the previous batch
+    """
+    batch = []
+    consumed = 0
+    for segment in segments:
+        segment_bytes = utf8_length(segment)
+        segment_consumed = 0
+        for chunk in iter_chunks(segment):
+            batch.append(chunk)
+            step = min(len(chunk.encode('utf-8')), segment_bytes - segment_consumed)
+            segment_consumed += step
+            consumed += step
+            if len(batch) >= batch_size:
+                yield batch, consumed
+                batch, consumed = [], 0
+        consumed += segment_bytes - segment_consumed
+
+    if batch or consumed:
+        yield batch, consumed
+
+
+if __name__ == "__main__":
+    # Memory benchmark: peak allocations while ingesting a large synthetic
+    # document, holding every chunk/embedding/record at once (the previous
+    # add_content) versus the batched pipeline. Embeddings are random 512-dim
+    # float lists like the ones parsed from Voyage responses, and inserts
+    # serialize their payload to JSON as the Supabase client does.
+    import json
+    import random
+    import time
+    import tracemalloc
+
+    size_mb = int(os.getenv("INGEST_BENCH_MB", "100"))
+    random.seed(0)
+    vocabulary = ["notion", "embedding", "mirror", "persona", "latency", "vector", "context", "the", "a", "of"]
+    paragraphs = []
+    written = 0
+    while written < size_mb * 1024 * 1024:
+        sentences = [
+            " ".join(random.choice(vocabulary) for _ in range(random.randint(5, 30))).capitalize() + "."
+            for _ in range(random.randint(1, 12))
+        ]
+        paragraph = " ".join(sentences)
+        paragraphs.append(paragraph)
+        written += len(paragraph) + 2
+    text = "\n\n".join(paragraphs)
+    del paragraphs
+
+    def fake_embed(chunks):
+        return [[random.random() for _ in range(512)] for _ in chunks]
+
+    def fake_insert(records):
+        json.dumps(records)
+
+    class FakeSupabase:
+        # Just enough of the client for ChunkWriter's upserts on a new document
+        def table(self, name):
+            return self
+
+        def upsert(self, rows, **kwargs):
+            self.rows = rows
+            return self
+
+        def execute(self):
+            fake_insert(self.rows)
+            self.rows = None
+
+    def all_at_once():
+        chunks = list(iter_chunks(text))
+        embeddings = fake_embed(chunks)
+        records = [
+            {'document_id': 'bench', 'content': chunk, 'embeddings': embedding, 'chunk_index': index}
+            for index, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+        ]
+        fake_insert(records)
+        return len(records)
+
+    def pipelined():
+        from chunk_writer import ChunkWriter
+        stats = ChunkWriter(FakeSupabase()).ingest('bench', [text], fake_embed, new_document=True)
+        return stats["rows_written"]
+
+    print(f"Ingesting {len(text) / 1024 / 1024:.1f} MB of synthetic text (input excluded from peaks)")
+    print("-" * 50)
+    for label, run in [("All at once", all_at_once), (f"Pipeline (batch {INGEST_BATCH_SIZE})", pipelined)]:
+        tracemalloc.start()
+        started = time.perf_counter()
+        count = run()
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label}: {count} chunks in {elapsed:.1f}s, peak {peak / 1024 / 1024:.1f} MB")
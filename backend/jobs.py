@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from uuid import uuid4
+
+logger = logging.getLogger(__name__)
+
+# Ingestion jobs run on this many asyncio workers per process. Finished jobs
+# are kept in memory for status lookups, up to JOB_HISTORY_SIZE of them.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))
+
+
+class Job:
+    """
+    One ingestion job and its progress.
+
+    Progress counters may be advanced from worker threads (the pipeline runs
+    its blocking steps through run_blocking), so they're guarded by a lock.
+    """
+
+    def __init__(self, kind: str, user_id: str):
+        self.id = str(uuid4())
+        self.kind = kind
+        self.user_id = user_id
+        self.status = "queued"
+        self.stage = None
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def set_stage(self, stage: str):
+        self.stage = stage
+
+    def advance(self, **counters):
+        with self._lock:
+            for name, amount in counters.items():
+                self.progress[name] = self.progress.get(name, 0) + amount
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "user_id": self.user_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": progress,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at
+        }
+
+
+class JobQueue:
+    """
+    In-process job queue drained by a fixed pool of asyncio workers.
+
+    Submitting returns the Job immediately; its status moves from queued to
+    running to succeeded or failed. Jobs are lost if the process restarts.
+    """
+
+    def __init__(self, workers: int = INGEST_WORKERS, history_size: int = JOB_HISTORY_SIZE):
+        self.workers = workers
+        self.history_size = history_size
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks = []
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, kind: str, user_id: str, run: Callable[[Job], Awaitable[dict]]) -> Job:
+        """
+        Queue a job.
+
+        Args:
+            kind (str): Job type, e.g. 'process_content' or 'notion_sync'
+            user_id (str): User the job ingests content for
+            run: Coroutine function taking the Job and returning its result,
+                a small summary (ids, counts): results stay in the job history
+
+        Returns:
+            Job: The queued job
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue has not been started")
+
+        job = Job(kind, user_id)
+        self._jobs[job.id] = job
+        self._trim_history()
+        self._queue.put_nowait((job, run))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def _trim_history(self):
+        # Drop the oldest finished jobs; queued and running ones are always kept
+        excess = len(self._jobs) - self.history_size
+        for job_id in list(self._jobs):
+            if excess <= 0:
+                break
+            if self._jobs[job_id].status in ("succeeded", "failed"):
+                del self._jobs[job_id]
+                excess -= 1
+
+    async def _worker(self):
+        while True:
+            job, run = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                job.result = await run(job)
+                job.status = "succeeded"
+            except Exception as e:
+                job.error = str(getattr(e, 'detail', None) or e)
+                job.status = "failed"
+                logger.error(f"Job {job.id} ({job.kind}) failed: {job.error}\n{traceback.format_exc()}")
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
@@ -1,6 +1,7 @@
 # main.py
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from supabase import create_client, Client
 from notion_client import AsyncClient
@@ -9,10 +10,26 @@ from dotenv import load_dotenv
 from typing import Optional
 from uuid import UUID, uuid4
 from agent import AIClient
-import traceback
+from retrieval import Retriever
+from context_builder import CONTEXT_MAX_CHUNKS
+from retrieval_cache import RetrievalCache
+from response_cache import SemanticResponseCache
+from conversation_memory import ConversationMemory
+from persona import PersonaPrefixes
+from vector_index import VECTOR_INDEX_DIR, VectorIndex
+from notion_sync import NotionSync
+from jobs import Job, JobQueue
+from ingest import utf8_length
+from chunk_writer import ChunkWriter
+from async_service import run_blocking, shutdown as shutdown_blocking_pool
+from metrics import METRICS_ENABLED, TraceMiddleware, metrics, stage
+from structured_logging import RequestLoggingMiddleware, configure_logging, log_event, shutdown_logging
+import asyncio
+import json
+import time
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from app_integrations.content_middleware import get_complete_content
+from app_integrations.content_middleware import get_content_segments, fetch_stats, url_cache
 from datetime import datetime 
 
 # Load environment variables from .env file
@@ -21,6 +38,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# JSON log lines written from a background thread; see structured_logging
+configure_logging()
+
 app = FastAPI()
 
 # Configure CORS to allow all localhost origins
@@ -36,8 +56,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-Id"],
 )
 
+# Per-request log sampling and redaction, decided from the path
+app.add_middleware(RequestLoggingMiddleware)
+
+# Per-request trace ids and latency, and the stage timings behind /metrics
+app.add_middleware(TraceMiddleware)
+
 # Initialize Supabase client
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
@@ -51,146 +78,366 @@ supabase: Client = create_client(supabase_url, supabase_key)
 # Initialize the AI client
 ai_client = AIClient()
 
+# Optional in-process ANN index over each user's chunks (enabled by VECTOR_INDEX_DIR)
+vector_index = VectorIndex(supabase) if VECTOR_INDEX_DIR else None
+
+# Reranked results per (user, corpus version, query); ingestion bumps the version
+retrieval_cache = RetrievalCache()
+
+# Opt-in (per profile) reuse of public-chat replies for near-identical questions
+response_cache = SemanticResponseCache(supabase)
+
+# Two-stage retriever (vector top-N, then rerank) used by the chat endpoints
+retriever = Retriever(supabase, ai_client, vector_index=vector_index, cache=retrieval_cache)
+
+# Recent messages and a rolling summary of each active conversation, for prompts
+conversation_memory = ConversationMemory(supabase, ai_client.summarize_conversation)
+
+# Each user's stable persona text, the prompt-cached prefix of their replies
+persona_prefixes = PersonaPrefixes(supabase)
+
+# Deduplicating, batched writer for the chunks table
+chunk_writer = ChunkWriter(supabase)
+
+# Incremental Notion sync (per-page documents with last_edited_time checkpoints)
+notion_sync = NotionSync(supabase, ai_client, chunk_writer, vector_index)
+
+# Background ingestion: process-content and Notion sync run as jobs
+ingest_jobs = JobQueue()
+
+@app.on_event("startup")
+async def start_ingest_jobs():
+    await ingest_jobs.start()
+
+@app.on_event("shutdown")
+async def stop_ingest_jobs():
+    await ingest_jobs.stop()
+    # Jobs no longer submit blocking calls; drain the pool (off the loop, as it waits)
+    await asyncio.to_thread(shutdown_blocking_pool)
+
+@app.on_event("shutdown")
+async def flush_logs():
+    shutdown_logging()
+
 @app.get("/")
 async def root():
-    tables = {
-        'conversations': supabase.table('conversations').select('*').execute(),
-        'documents': supabase.table('documents').select('*').execute(),
-        'messages': supabase.table('messages').select('*').execute(),
-        'profiles': supabase.table('profiles').select('*').execute(),
-        'scraped_content': supabase.table('scraped_content').select('*').execute()
-    }
+    table_names = ['conversations', 'documents', 'messages', 'profiles', 'scraped_content']
+    results = await asyncio.gather(*(
+        run_blocking(supabase.table(name).select('*').execute) for name in table_names
+    ))
+    tables = dict(zip(table_names, results))
     return tables
 
 
+@app.get("/api/cache-stats")
+async def cache_stats():
+    return {
+        "embeddings": ai_client.embedding_cache.stats(),
+        "url_content": url_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "responses": response_cache.stats(),
+        "prompt": ai_client.llm_usage.stats(),
+        "personas": persona_prefixes.stats(),
+        "conversations": conversation_memory.stats(),
+        "vector_index": vector_index.stats() if vector_index else None
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Stage and request latency histograms of this worker, in Prometheus text format
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/fetch-stats")
+async def url_fetch_stats():
+    # Usage and latency of the plain HTTP and browser tiers used by /api/process-content
+    return fetch_stats.snapshot()
+
+
+def corpus_changed(user_id: str):
+    # Cached retrievals, replies and persona text for this user no longer reflect their content
+    retrieval_cache.bump(user_id)
+    response_cache.bump(user_id)
+    persona_prefixes.invalidate(user_id)
+
+
 class ContentRequest(BaseModel):
     user_id: str
     content: str
 
-@app.post("/api/add-content")
-async def add_content(request: ContentRequest):
-    try:
-        print("Raw request body:", request)
-        # Generate a unique document_id for the entire document
-        document_id = str(uuid4())
+async def store_content(user_id: str, content, job: Optional[Job] = None):
+    """
+    Store content as a new 'user' document with its chunks and embeddings.
+
+    Chunks are embedded and written INGEST_BATCH_SIZE at a time as they are
+    produced, so memory stays flat however large the content is. Repeated
+    chunks within the content are stored once.
+
+    Args:
+        user_id (str): Owner of the document
+        content: The text, or a list of segments that are chunked independently
+        job (Job): Optional ingestion job whose progress is advanced as
+            chunks are embedded and inserted
 
-        # Insert a new document entry
-        document_response = supabase.table('documents').insert({
+    Returns:
+        dict: The document id and number of chunks added
+    """
+    segments = [content] if isinstance(content, str) else content
+
+    # Generate a unique document_id for the entire document
+    document_id = str(uuid4())
+
+    # Insert a new document entry
+    with stage("db_insert"):
+        document_response = await run_blocking(supabase.table('documents').insert({
             'id': document_id,
-            'user_id': request.user_id,
+            'user_id': user_id,
             'scrape_source': 'user'
-        }).execute()
-
-        # Generate embeddings using the AI client
-        chunks, embeddings = ai_client.generate_embeddings(request.content)
-        if not chunks or not embeddings:
-            raise HTTPException(status_code=500, detail="Failed to generate embeddings")
+        }).execute)
 
-        # Insert each chunk and its corresponding embedding into the scraped_content table
-        records = []
-        for index, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-            records.append({
-                'document_id': document_id,  # Use the same document_id for all chunks
-                'content': chunk,
-                'embeddings': embedding,
-                'chunk_index': index
-            })
+    if job:
+        job.set_stage("embed")
+        job.advance(bytes_total=sum(utf8_length(segment) for segment in segments))
 
-        # Batch insert records into the database
-        response = supabase.table('chunks').insert(records).execute()
+    observer = vector_index.observer(user_id, 'user') if vector_index else None
+    try:
+        write_stats = await run_blocking(
+            chunk_writer.ingest, document_id, segments, ai_client.embed_documents, job, True, observer
+        )
+        log_event(logger, logging.INFO, "chunks_written", document_id=document_id, **write_stats)
+        chunks_added = write_stats["rows_written"]
+        if not chunks_added:
+            raise HTTPException(status_code=500, detail="Failed to generate embeddings")
+    except Exception:
+        # Don't leave a partially ingested document behind; chunks cascade
+        await run_blocking(supabase.table('documents').delete().eq('id', document_id).execute)
+        if vector_index:
+            await run_blocking(vector_index.remove, user_id, document_id)
+        raise
+    finally:
+        # Chunks become searchable as they're written, so cached answers are stale either way
+        corpus_changed(user_id)
+
+    return {"message": "Content added successfully", "chunks_added": chunks_added, "document_id": document_id, **write_stats}
 
-        return {"message": "Content added successfully", "chunks_added": len(records), "document_id": document_id}
+@app.post("/api/add-content")
+async def add_content(request: ContentRequest):
+    try:
+        log_event(logger, logging.INFO, "add_content", user_id=request.user_id, content=request.content,
+                  content_chars=len(request.content))
+        return await store_content(request.user_id, request.content)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-def fetch_and_concatenate_user_documents(user_id: str, scrape_source: Optional[str] = None):
-    try:
-        # Start building the query
-        query = supabase.table('documents').select('id, created_at').eq('user_id', user_id)
+# Page sizes for bulk document fetches. Documents are processed one page at a
+# time so memory stays bounded for users with very large corpora; the chunk
+# page size matches PostgREST's default max-rows.
+DOCUMENT_PAGE_SIZE = 100
+CHUNK_PAGE_SIZE = 1000
+
+def fetch_chunks_for_documents(document_ids: list):
+    """
+    Fetch the chunks of several documents with one paginated `in_` query
+    instead of one query per document.
+    """
+    offset = 0
+    while True:
+        with stage("fetch_documents"):
+            response = supabase.table('chunks')\
+                .select('document_id, content, chunk_index')\
+                .in_('document_id', document_ids)\
+                .order('id')\
+                .range(offset, offset + CHUNK_PAGE_SIZE - 1)\
+                .execute()
 
-        # Conditionally add the scrape_source filter
-        if scrape_source is not None:
-            query = query.eq('scrape_source', scrape_source)
+        rows = response.data or []
+        yield from rows
 
-        # Execute the query
-        document_response = query.execute()
+        if len(rows) < CHUNK_PAGE_SIZE:
+            break
+        offset += CHUNK_PAGE_SIZE
 
+def fetch_user_documents_page(user_id: str, scrape_source: Optional[str] = None, offset: int = 0,
+                              limit: int = DOCUMENT_PAGE_SIZE) -> list:
+    """
+    One page of a user's documents, oldest first, with their chunks
+    concatenated in chunk_index order. Costs one documents query plus one
+    bulk chunks query (more only if the page has over CHUNK_PAGE_SIZE chunks).
+    """
+    # Start building the query
+    query = supabase.table('documents').select('id, created_at').eq('user_id', user_id)
+
+    # Conditionally add the scrape_source filter
+    if scrape_source is not None:
+        query = query.eq('scrape_source', scrape_source)
+
+    with stage("fetch_documents"):
+        # id breaks created_at ties, so consecutive pages never skip or repeat a document
+        document_response = query\
+            .order('created_at')\
+            .order('id')\
+            .range(offset, offset + limit - 1)\
+            .execute()
+    page = document_response.data or []
+    if not page:
+        return []
 
-        document_ids = [doc['id'] for doc in document_response.data]
+    # Group chunks by document, then sort each group in memory
+    chunks_by_document = {doc['id']: [] for doc in page}
+    for chunk in fetch_chunks_for_documents(list(chunks_by_document)):
+        chunks_by_document[chunk['document_id']].append(chunk)
+
+    documents = []
+    for doc in page:
+        chunks = sorted(chunks_by_document.pop(doc['id']), key=lambda chunk: chunk['chunk_index'])
+        documents.append({
+            "document_id": doc['id'],
+            "content": "\n".join(chunk['content'] for chunk in chunks),
+            "created_at": doc['created_at']
+        })
+    return documents
+
+def iter_user_documents(user_id: str, scrape_source: Optional[str] = None, page_size: int = DOCUMENT_PAGE_SIZE):
+    """
+    Yield a user's documents with their chunks concatenated, a page at a time.
+    """
+    offset = 0
+    while True:
+        page = fetch_user_documents_page(user_id, scrape_source, offset, page_size)
+        yield from page
+        if len(page) < page_size:
+            break
+        offset += page_size
 
-        # If no documents are found, return an empty list
-        if not document_ids:
-            return []
 
-        documents = []
+@app.get("/api/user-documents/{user_id}")
+async def get_user_documents(user_id: str, limit: int = DOCUMENT_PAGE_SIZE, offset: int = 0):
+    """
+    A page of the user's documents, oldest first.
 
-        # Fetch and concatenate content chunks for each document
-        for index, document_id in enumerate(document_ids):
-            response = supabase.table('scraped_content')\
-                .select('content, chunk_index')\
-                .eq('document_id', document_id)\
-                .order('chunk_index')\
-                .execute()
+    Args:
+        limit (int): Documents per page, at most DOCUMENT_PAGE_SIZE
+        offset (int): Documents to skip; pass the previous page's next_offset
 
-            # Concatenate the content chunks
-            documents_content = "\n".join(chunk['content'] for chunk in response.data)
+    Returns:
+        dict: The documents, and next_offset (None on the last page)
+    """
+    limit = max(1, min(limit, DOCUMENT_PAGE_SIZE))
+    offset = max(0, offset)
+    try:
+        documents = await run_blocking(fetch_user_documents_page, user_id, None, offset, limit)
+        next_offset = offset + limit if len(documents) == limit else None
+        return {"documents": documents, "next_offset": next_offset}
+    except Exception as e:
+        logger.exception("Error fetching user documents")
+        raise HTTPException(status_code=500, detail=str(e))
 
-            documents.append({
-                "document_id": document_id,
-                "content": documents_content,
-                "created_at": document_response.data[index]['created_at']
-            })
 
-        return documents
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
 
-    except Exception as e:
-        print(f"Exception occurred: {e}")
-        return []
+def inserted_id(response) -> Optional[int]:
+    return response.data[0]['id'] if response.data else None
+
+def stream_bot_reply(query: str, documents: list, message_fields: dict, started: float, retrieval_stats: dict,
+                     texts=None, on_reply=None, history=None, persona=None):
+    """
+    Stream the LLM reply as server-sent events ("token" events, then one "done"
+    event) and persist the complete bot message once the stream finishes.
 
+    Args:
+        query (str): The user's message
+        documents (list): Retrieved context passed to the LLM
+        message_fields (dict): Columns of the bot message row other than content
+        started (float): perf_counter() at request start, for time-to-first-token
+        retrieval_stats (dict): Included in the final event
+        texts: Reply text to stream instead of calling the LLM (e.g. a cached reply)
+        on_reply: Called with the reply and token usage once an LLM reply completes
+        history (History): Earlier turns of the conversation
+        persona (str): The person's persona text
+    """
+    parts = []
+    time_to_first_token_ms = None
+    usage = {}
+
+    if texts is None:
+        texts = ai_client.stream_response_with_llm(query, documents, usage, history, persona)
+    for text in texts:
+        if time_to_first_token_ms is None:
+            time_to_first_token_ms = round((time.perf_counter() - started) * 1000, 2)
+            log_event(logger, logging.INFO, "first_token", time_to_first_token_ms=time_to_first_token_ms)
+        parts.append(text)
+        yield sse_event("token", {"text": text})
+
+    bot_message = {**message_fields, 'content': "".join(parts).strip()}
+    if 'created_at' in bot_message:
+        bot_message['created_at'] = datetime.utcnow().isoformat()
 
-@app.get("/api/user-documents/{user_id}")
-async def get_user_documents(user_id: str):
     try:
-        documents = fetch_and_concatenate_user_documents(user_id)
-        return {"documents": documents}
+        with stage("db_insert"):
+            inserted = supabase.table('messages').insert(bot_message).execute()
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        logger.error(f"Error persisting streamed bot message: {e}")
+        yield sse_event("error", {"detail": str(e)})
+        return
+    conversation_memory.record_turn(message_fields['conversation_id'], query, bot_message['content'], inserted_id(inserted))
+
+    if on_reply and usage:
+        on_reply(bot_message['content'], usage)
 
+    yield sse_event("done", {
+        "reply": bot_message,
+        "retrieval": retrieval_stats,
+        "time_to_first_token_ms": time_to_first_token_ms,
+        "total_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
 
 @app.post("/api/process-message")
 async def process_message(request: Request):
     try:
+        started = time.perf_counter()
         body = await request.json()
-        print(f"Raw request body: {body}")
         conversation_id = body['conversation_id']
         user_id = body['user_id']
         content = body['content']
-
-        # Fetch user documents using the new function
-        user_documents = fetch_and_concatenate_user_documents(user_id)
-
-        # If no user content is found, generate a response without RAG
-        if not user_documents:
-            print("No user content found, generating response without RAG")
-            bot_response_content = ai_client.generate_response_with_llm(content, [])
-            print(f"Generated bot response without RAG: {bot_response_content}")
-        else:
-            # Combine all content
-            k = 5
-            print(user_documents)
-            all_content = [doc['content'] for doc in user_documents]
-
-            # Rerank documents using the AI client
-            ranked_documents = ai_client.rerank_documents(all_content, content, k)
-            
-            if not ranked_documents:
-                raise HTTPException(status_code=404, detail="No relevant documents found")
-
-            # Use the AI client to generate a response based on the top-ranked documents
-            top_documents = ranked_documents[:k]  # Get top 3 documents
-            bot_response_content = ai_client.generate_response_with_llm(content, top_documents)
-            print(f"Generated bot response: {bot_response_content}")
+        log_event(logger, logging.INFO, "chat_request", user_id=user_id, conversation_id=conversation_id,
+                  content=content, stream=bool(body.get('stream')))
+
+        # Retrieve the most relevant chunks: vector top-N, then rerank, packed into the context budget,
+        # alongside the conversation's recent messages and summary and the user's persona text
+        k = CONTEXT_MAX_CHUNKS
+        retrieval, history, persona = await asyncio.gather(
+            run_blocking(retriever.retrieve, user_id, content, k),
+            run_blocking(conversation_memory.history, conversation_id, content),
+            run_blocking(persona_prefixes.get, user_id)
+        )
+        log_event(logger, logging.INFO, "retrieval", user_id=user_id, **retrieval.stats)
+
+        # Streaming mode: tokens are sent as they arrive, the reply is persisted at the end
+        if body.get('stream'):
+            return StreamingResponse(
+                stream_bot_reply(
+                    content,
+                    retrieval.documents,
+                    {'conversation_id': conversation_id, 'is_bot': True},
+                    started,
+                    retrieval.stats,
+                    history=history,
+                    persona=persona
+                ),
+                media_type="text/event-stream"
+            )
+
+        # Generate a response from the top-ranked chunks (without RAG if no user content was found)
+        bot_response_content = await run_blocking(
+            ai_client.generate_response_with_llm, content, retrieval.documents, history, persona
+        )
+        log_event(logger, logging.INFO, "bot_reply", conversation_id=conversation_id, rag=bool(retrieval.documents),
+                  reply=bot_response_content, reply_chars=len(bot_response_content))
 
         # Insert the bot's response into the messages table
         bot_message = {
@@ -199,20 +446,21 @@ async def process_message(request: Request):
             'is_bot': True
         }
 
-        print(f"Inserting bot message into database: {bot_message}")
-        bot_response = supabase.table('messages').insert(bot_message).execute()
-        print(f"Database response: {bot_response}")
+        with stage("db_insert"):
+            bot_response = await run_blocking(supabase.table('messages').insert(bot_message).execute)
+        conversation_memory.record_turn(conversation_id, content, bot_response_content, inserted_id(bot_response))
 
         return {
             "reply": {
                 "content": bot_response_content,
                 "conversation_id": conversation_id,
                 "is_bot": True
-            }
+            },
+            "retrieval": retrieval.stats
         }
 
     except Exception as e:
-        print(f"Exception occurred: {e}")
+        logger.exception("Error in process_message")
         raise HTTPException(status_code=500, detail=str(e))
 
 # Basic select all
@@ -278,18 +526,28 @@ async def get_blocks_recursively(notion_client, block_id, blocks):
 class NotionSyncRequest(BaseModel):
     user_id: str
     
-@app.post("/sync/notion")
+async def run_notion_sync(job: Job, user_id: str, notion_token: str) -> dict:
+    # Only pages edited since the last sync are re-extracted and re-embedded
+    notion_client = AsyncClient(auth=notion_token)
+    try:
+        stats = await notion_sync.sync(notion_client, user_id, job)
+    finally:
+        corpus_changed(user_id)
+    log_event(logger, logging.INFO, "notion_sync_finished", user_id=user_id, **stats)
+    return {"message": "Notion content synced", **stats}
+
+@app.post("/sync/notion", status_code=202)
 async def sync_notion_content(request: NotionSyncRequest):
     try:
         user_id = request.user_id
-        logger.debug(f"Received sync request for user: {user_id}")
+        log_event(logger, logging.DEBUG, "notion_sync_request", user_id=user_id)
 
-        # Get Notion token from Supabase profiles - using sync client
-        response = supabase.table('profiles') \
+        # Get Notion token from Supabase profiles - sync client, run off the event loop
+        response = await run_blocking(supabase.table('profiles') \
             .select('notion_access_token') \
             .eq('id', user_id) \
             .single() \
-            .execute()
+            .execute)
         
         if not response.data:
             raise HTTPException(status_code=404, detail="User profile not found")
@@ -298,59 +556,26 @@ async def sync_notion_content(request: NotionSyncRequest):
         if not notion_token:
             raise HTTPException(status_code=400, detail="Notion token not found")
 
-        # Rest of your code remains the same
-        notion_client = AsyncClient(auth=notion_token)
-        
-        all_pages = await get_all_pages_and_databases(notion_client)
-        
-        text_content = '\n'.join(all_pages)
+        job = ingest_jobs.submit("notion_sync", user_id, lambda job: run_notion_sync(job, user_id, notion_token))
+        return {"message": "Notion sync queued", "job_id": job.id, "status": job.status}
 
-        result = await add_content(ContentRequest(content=text_content, user_id=user_id))
-        
-        print("done")
-        
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error syncing Notion content: {e}")
+        logger.exception("Error syncing Notion content")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def get_all_pages_and_databases(notion_client):
-    pages = []
-    next_cursor = None
-
-    while True:
-        response = await notion_client.search(
-            **{
-                "filter": {"property": "object", "value": "page"},
-                "start_cursor": next_cursor,
-                "page_size": 100,
-            }
-        )
-        for page in response.get('results', []):
-            # Extract text content from each page
-            page_text = await extract_text_from_blocks(notion_client, page['id'])
-            if len(page_text.strip()) > 0:
-                pages.append(
-                    page_text
-                )
-        
-        next_cursor = response.get('next_cursor')
-        if not response.get('has_more'):
-            break
-
-    return pages
-
 async def get_provider_token(provider: str, access_token: str):
     try:
-        response = supabase.auth.get_user(access_token)
+        response = await run_blocking(supabase.auth.get_user, access_token)
         if not response.user:
             raise HTTPException(status_code=401, detail="Invalid access token")
             
         identities = response.user.identities
         notion_identity = next((i for i in identities if i.provider == provider), None)
         
-        # Debug log to see the structure
-        logger.debug(f"Notion identity object: {notion_identity}")
-        print(f"Notion identity object: {notion_identity}")
+        # The identity's data holds the provider token, so only its presence is logged
+        log_event(logger, logging.DEBUG, "provider_identity", provider=provider, found=notion_identity is not None)
         
         if not notion_identity:
             raise HTTPException(status_code=404, detail=f"No {provider} connection found")
@@ -370,47 +595,82 @@ class ContentProcessRequest(BaseModel):
     # user_id: str is not optional
     user_id: str
 
-@app.post("/api/process-content")
-async def process_content(request: ContentRequest):
+async def run_process_content(job: Job, user_id: str, content: str) -> dict:
+    """
+    Ingestion pipeline behind /api/process-content: extract URL content,
+    then chunk, embed and insert it.
+    """
+    log_event(logger, logging.DEBUG, "process_content", user_id=user_id, content=content)
+    job.set_stage("extract")
+
+    # Resolve every URL in the content concurrently (cached URLs skip the fetch)
+    with stage("scrape"):
+        segments = await get_content_segments(content)
+    # The segments are never joined: that would be another copy of the whole content
+    processed_chars = sum(len(segment) for segment in segments)
+
+    # Each URL's content is chunked on its own, so a cached URL yields the
+    # same chunks as last time and their embeddings come from the cache,
+    # and the chunk writer consumes them one batch at a time
+    log_event(logger, logging.INFO, "content_extracted", user_id=user_id, segments=len(segments),
+              processed_chars=processed_chars)
+    result = await store_content(user_id, segments, job)
+
+    # Kept in the job history, so only counts: the text itself is in the document's chunks
+    return {
+        "message": "Content processed successfully",
+        "processed_chars": processed_chars,
+        **result
+    }
+
+@app.post("/api/process-content", status_code=202)
+async def process_content(request: ContentRequest, response: Response, wait: bool = False):
     """
     Process text to extract and fetch content from all URLs.
     
     Args:
         request (ContentProcessRequest): Request containing text with URLs
+        wait (bool): Run the pipeline inline and return its result instead
+            of a job id
     
     Returns:
-        dict: Processed text with URL contents
+        dict: The queued job (poll /api/jobs/{id}), or the job's result
+            (document id and chunk counts) when wait is set
     """
     try:
-        logger.debug(f"Processing content request: {request.content}")
-        
-        # Process the content using get_complete_content
-        processed_text = get_complete_content(request.content)
-        
-        # Reuse add_content logic
-        content_request = ContentRequest(
-            content=processed_text,
-            user_id=request.user_id if hasattr(request, 'user_id') else None
+        job = ingest_jobs.submit(
+            "process_content",
+            request.user_id,
+            lambda job: run_process_content(job, request.user_id, request.content)
         )
+        if not wait:
+            return {"message": "Content queued for processing", "job_id": job.id, "status": job.status}
+
+        while job.status in ("queued", "running"):
+            await asyncio.sleep(0.2)
+        if job.status == "failed":
+            raise HTTPException(status_code=500, detail=job.error)
+        response.status_code = 200
+        return job.result
         
-        print(processed_text)
-        result = await add_content(content_request)
-        
-        return {
-            "message": "Content processed successfully",
-            "processed_text": processed_text,
-            **result
-        }
-        
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing content: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
 @app.post("/functions/v1/public-chat")
 async def process_message_public(request: Request):
     try:
+        started = time.perf_counter()
         body = await request.json()
-        print(f"Raw request body: {body}")
         
         # Required fields validation
         required_fields = ['user_id', 'content']
@@ -424,17 +684,22 @@ async def process_message_public(request: Request):
         user_id = body['user_id']
         content = body['content']
         conversation_id = body.get('conversation_id')
+        log_event(logger, logging.INFO, "public_chat_request", user_id=user_id, conversation_id=conversation_id,
+                  content=content, stream=bool(body.get('stream')))
 
         # Create a new conversation if conversation_id is null
         if not conversation_id:
-            print('No conversation ID. Creating a new conversation...')
-            conversation_response = supabase.table('conversations') \
-                .insert({'user_id': 'public', 'title': f"Public Chat with User {user_id}"}) \
-                .execute()
+            with stage("db_insert"):
+                conversation_response = await run_blocking(supabase.table('conversations') \
+                    .insert({'user_id': 'public', 'title': f"Public Chat with User {user_id}"}) \
+                    .execute)
             if not conversation_response.data:
                 raise HTTPException(status_code=500, detail="Failed to create a new conversation")
             conversation_id = conversation_response.data[0]['id']
-            print('New conversation ID:', conversation_id)
+            log_event(logger, logging.INFO, "conversation_created", conversation_id=conversation_id)
+            conversation_memory.start(conversation_id)
+
+        history = await run_blocking(conversation_memory.history, conversation_id, content)
 
         # Insert user message
         user_message = {
@@ -443,29 +708,83 @@ async def process_message_public(request: Request):
             'is_bot': False,
             'created_at': datetime.utcnow().isoformat()
         }
-        supabase.table('messages').insert(user_message).execute()
-
-        # Get the target user's documents
-        user_documents = fetch_and_concatenate_user_documents(user_id)
-
-        # Generate response based on available content
-        if not user_documents:
-            print("No user content found, generating response without RAG")
-            bot_response_content = ai_client.generate_response_with_llm(content, [])
-            print(f"Generated bot response without RAG: {bot_response_content}")
-        else:
-            k = 5
-            print(f"Found user documents: {user_documents}")
-            all_content = [doc['content'] for doc in user_documents]
-            ranked_documents = ai_client.rerank_documents(all_content, content, k)
-            
-            if not ranked_documents:
-                bot_response_content = ai_client.generate_response_with_llm(content, [])
-                print(f"No relevant documents found, generating response without RAG: {bot_response_content}")
+        with stage("db_insert"):
+            await run_blocking(supabase.table('messages').insert(user_message).execute)
+
+        # Opt-in semantic cache: a near-identical question to this persona reuses its reply.
+        # Only for opening messages, since later replies depend on the conversation.
+        cache_enabled, cache_threshold = await run_blocking(response_cache.settings, user_id)
+        cache_enabled = cache_enabled and not history.messages and not history.summary
+        query_embedding = None
+        cached = None
+        on_reply = None
+        if cache_enabled:
+            cache_version = response_cache.version(user_id)
+            query_embedding = await run_blocking(ai_client.embed_query, content)
+        if query_embedding is not None:
+            cached = response_cache.get(user_id, query_embedding, cache_threshold)
+            if cached:
+                entry, similarity = cached
+                # The matched query was asked by another visitor: it goes to the (redacted) log only
+                reply_stats = {"response_cache": "hit", "similarity": round(similarity, 4)}
+                log_event(logger, logging.INFO, "response_cache_hit", user_id=user_id, cached_query=entry.query, **reply_stats)
+                if body.get('stream'):
+                    return StreamingResponse(
+                        stream_bot_reply(
+                            content,
+                            [],
+                            {'conversation_id': conversation_id, 'is_bot': True, 'created_at': None},
+                            started,
+                            reply_stats,
+                            texts=[entry.reply]
+                        ),
+                        media_type="text/event-stream"
+                    )
+                bot_response_content = entry.reply
             else:
-                top_documents = ranked_documents[:k]
-                bot_response_content = ai_client.generate_response_with_llm(content, top_documents)
-                print(f"Generated bot response with RAG: {bot_response_content}")
+                def on_reply(reply: str, usage: dict):
+                    response_cache.put(
+                        user_id, cache_version, content, query_embedding, reply,
+                        sum(usage.values()), (time.perf_counter() - started) * 1000
+                    )
+
+        if not cached:
+            # Retrieve the target user's most relevant chunks, packed into the context budget,
+            # and their persona text
+            k = CONTEXT_MAX_CHUNKS
+            retrieval, persona = await asyncio.gather(
+                run_blocking(retriever.retrieve, user_id, content, k),
+                run_blocking(persona_prefixes.get, user_id)
+            )
+            log_event(logger, logging.INFO, "retrieval", user_id=user_id, **retrieval.stats)
+            reply_stats = retrieval.stats
+            if cache_enabled:
+                reply_stats["response_cache"] = "miss"
+
+            # Streaming mode: tokens are sent as they arrive, the reply is persisted at the end
+            if body.get('stream'):
+                return StreamingResponse(
+                    stream_bot_reply(
+                        content,
+                        retrieval.documents,
+                        {'conversation_id': conversation_id, 'is_bot': True, 'created_at': None},
+                        started,
+                        reply_stats,
+                        on_reply=on_reply,
+                        history=history,
+                        persona=persona
+                    ),
+                    media_type="text/event-stream"
+                )
+
+            # Generate response based on available content
+            bot_response_content, usage = await run_blocking(
+                ai_client.generate_response_with_usage, content, retrieval.documents, history, persona
+            )
+            log_event(logger, logging.INFO, "bot_reply", conversation_id=conversation_id, rag=bool(retrieval.documents),
+                      reply=bot_response_content, reply_chars=len(bot_response_content))
+            if on_reply and usage:
+                on_reply(bot_response_content, usage)
 
         # Insert bot response into messages
         bot_message = {
@@ -474,7 +793,9 @@ async def process_message_public(request: Request):
             'is_bot': True,
             'created_at': datetime.utcnow().isoformat()
         }
-        supabase.table('messages').insert(bot_message).execute()
+        with stage("db_insert"):
+            bot_response = await run_blocking(supabase.table('messages').insert(bot_message).execute)
+        conversation_memory.record_turn(conversation_id, content, bot_response_content, inserted_id(bot_response))
 
         return {
             "reply": {
@@ -482,61 +803,14 @@ async def process_message_public(request: Request):
                 "conversation_id": conversation_id,
                 "is_bot": True,
                 "created_at": bot_message['created_at']
-            }
+            },
+            "retrieval": reply_stats
         }
 
     except Exception as e:
-        print(f"Exception occurred in process_message_public: {e}")
-        print(f"Exception traceback: {traceback.format_exc()}")
+        logger.exception("Error in process_message_public")
         raise HTTPException(status_code=500, detail=str(e))
 
-async def extract_text_from_blocks(notion_client, block_id):
-    text_content = []
-    
-    async def get_block_text(block):
-        # Extract text based on block type
-        block_type = block.get('type')
-        if not block_type:
-            return
-
-        content = block.get(block_type)
-        if not content:
-            return
-
-        # Handle different types of text blocks
-        if block_type in ['paragraph', 'heading_1', 'heading_2', 'heading_3', 'bulleted_list_item', 'numbered_list_item']:
-            rich_text = content.get('rich_text', [])
-            text = ' '.join([t.get('plain_text', '') for t in rich_text if t.get('plain_text')])
-            if text:
-                text_content.append(text)
-
-    # Get all blocks
-    blocks = []
-    next_cursor = None
-    
-    while True:
-        response = await notion_client.blocks.children.list(
-            block_id=block_id,
-            start_cursor=next_cursor,
-            page_size=100
-        )
-        
-        blocks.extend(response.get('results', []))
-        
-        next_cursor = response.get('next_cursor')
-        if not next_cursor:
-            break
-
-    # Process each block
-    for block in blocks:
-        await get_block_text(block)
-        
-        # If block has children, process them recursively
-        if block.get('has_children'):
-            await extract_text_from_blocks(notion_client, block['id'])
-
-    return ' '.join(text_content)
-
 if __name__ == "__main__":
     import uvicorn
     
@@ -0,0 +1,248 @@
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+
+from async_service import run_blocking
+from chunk_writer import ChunkWriter
+from jobs import Job
+from structured_logging import log_event
+from notion_crawler import NotionCrawler
+
+logger = logging.getLogger(__name__)
+
+# Notion's search endpoint returns at most 100 results per request
+SEARCH_PAGE_SIZE = 100
+# Notion rounds last_edited_time down to the minute, so an edit can share its
+# timestamp with a sync that ran up to a minute later
+EDIT_TIME_RESOLUTION = timedelta(minutes=1)
+# Page writes (chunk, embed, upsert) in flight at once across all syncs. Each
+# holds a thread of the shared blocking pool, which chat requests also use.
+NOTION_SYNC_WRITE_CONCURRENCY = int(os.getenv("NOTION_SYNC_WRITE_CONCURRENCY", "4"))
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    # Notion returns "...T10:00:00.000Z", PostgREST returns "...T10:00:00+00:00"
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class NotionSync:
+    """
+    Incremental Notion sync for one backend instance.
+
+    Every Notion page is stored as its own 'notion' document. A per-user cursor
+    (the newest last_edited_time already synced) lets the search listing stop
+    early, and per-page checkpoints decide which of the listed pages changed.
+    Only changed pages are re-extracted, and only their chunks are replaced.
+    """
+
+    def __init__(self, supabase, ai_client, chunk_writer: ChunkWriter, vector_index=None):
+        self.supabase = supabase
+        self.ai_client = ai_client
+        self.chunk_writer = chunk_writer
+        self.vector_index = vector_index
+        self._writes = asyncio.Semaphore(NOTION_SYNC_WRITE_CONCURRENCY)
+
+    def load_cursor(self, user_id: str) -> Optional[datetime]:
+        response = self.supabase.table('notion_sync_state')\
+            .select('last_edited_cursor')\
+            .eq('user_id', user_id)\
+            .execute()
+        rows = response.data or []
+        return parse_timestamp(rows[0]['last_edited_cursor']) if rows else None
+
+    def save_cursor(self, user_id: str, cursor: Optional[datetime]):
+        self.supabase.table('notion_sync_state').upsert({
+            'user_id': user_id,
+            'last_edited_cursor': cursor.isoformat() if cursor else None,
+            'synced_at': datetime.utcnow().isoformat()
+        }).execute()
+
+    def load_checkpoints(self, user_id: str, page_ids: list) -> dict:
+        response = self.supabase.table('notion_page_checkpoints')\
+            .select('page_id, document_id, last_edited_time, synced_at')\
+            .eq('user_id', user_id)\
+            .in_('page_id', page_ids)\
+            .execute()
+        return {row['page_id']: row for row in response.data or []}
+
+    @staticmethod
+    def is_current(checkpoint: dict, edited: datetime) -> bool:
+        """
+        Whether a page's checkpoint covers its listed last_edited_time. A sync
+        within a minute of the (rounded) edit time may have missed a later
+        edit in the same minute, so such pages are checked again; unchanged
+        chunks are skipped by the chunk writer, so this costs a crawl only.
+        """
+        synced_at = parse_timestamp(checkpoint.get('synced_at'))
+        return (
+            parse_timestamp(checkpoint['last_edited_time']) >= edited
+            and synced_at is not None
+            and synced_at >= edited + EDIT_TIME_RESOLUTION
+        )
+
+    def store_page(self, user_id: str, page_id: str, last_edited_time: str, text: str,
+                   document_id: Optional[str], job: Optional[Job] = None) -> dict:
+        """
+        Bring one page's document up to date and advance its checkpoint.
+
+        Unchanged chunks are kept as they are; only new chunks are embedded,
+        and chunks no longer on the page are deleted.
+
+        Args:
+            user_id (str): Owner of the Notion workspace
+            page_id (str): Notion page id
+            last_edited_time (str): The page's last_edited_time as returned by Notion
+            text (str): Extracted page text
+            document_id (str): The page's existing document, or None on first sync
+            job (Job): Optional ingestion job whose progress is advanced
+
+        Returns:
+            dict: Row counts from ChunkWriter.ingest
+        """
+        new_document = document_id is None
+        if new_document:
+            document_id = str(uuid4())
+            self.supabase.table('documents').insert({
+                'id': document_id,
+                'user_id': user_id,
+                'scrape_source': 'notion'
+            }).execute()
+
+        # Chunk, embed and write in fixed-size batches so large pages don't spike memory
+        observer = self.vector_index.observer(user_id, 'notion') if self.vector_index else None
+        write_stats = self.chunk_writer.ingest(
+            document_id, [text], self.ai_client.embed_documents, job, new_document, observer
+        )
+
+        self.supabase.table('notion_page_checkpoints').upsert({
+            'user_id': user_id,
+            'page_id': page_id,
+            'document_id': document_id,
+            'last_edited_time': last_edited_time,
+            'synced_at': datetime.utcnow().isoformat()
+        }).execute()
+        return write_stats
+
+    def remove_page(self, user_id: str, document_id: str):
+        # Deleting the document cascades to its chunks and checkpoint
+        self.supabase.table('documents').delete().eq('id', document_id).execute()
+        if self.vector_index:
+            self.vector_index.remove(user_id, document_id)
+
+    async def sync_page(self, crawler: NotionCrawler, user_id: str, page: dict, document_id: Optional[str],
+                        stats: dict, job: Optional[Job] = None):
+        try:
+            text = await crawler.extract_text(page['id'])
+            if not text.strip():
+                # Nothing to index; a page that was emptied loses its old content
+                if document_id:
+                    async with self._writes:
+                        await run_blocking(self.remove_page, user_id, document_id)
+                    stats["pages_removed"] += 1
+                stats["pages_empty"] += 1
+                return
+            async with self._writes:
+                write_stats = await run_blocking(
+                    self.store_page, user_id, page['id'], page['last_edited_time'], text, document_id, job
+                )
+            for name, count in write_stats.items():
+                stats[name] += count
+            stats["pages_synced"] += 1
+            if job:
+                job.advance(pages_synced=1)
+        except Exception as e:
+            log_event(logger, logging.WARNING, "notion_page_failed", user_id=user_id, page_id=page['id'], error=str(e))
+            stats["pages_failed"] += 1
+
+    async def sync(self, notion_client, user_id: str, job: Optional[Job] = None) -> dict:
+        """
+        Sync the pages a Notion token can see that changed since the last sync.
+
+        Pages are listed newest-edited first, so listing stops at the first page
+        older than the user's cursor. The cursor only advances when every
+        changed page synced; failed pages are retried on the next run.
+
+        Args:
+            notion_client: notion_client.AsyncClient for the user's token
+            user_id (str): Owner of the synced documents
+            job (Job): Optional ingestion job whose progress is advanced
+
+        Returns:
+            dict: Counts of pages listed, changed, synced, removed, empty and failed,
+            and chunk rows written, reindexed, skipped and deleted
+        """
+        stats = {"pages_listed": 0, "pages_changed": 0, "pages_synced": 0,
+                 "pages_removed": 0, "pages_empty": 0, "pages_failed": 0,
+                 "rows_written": 0, "rows_reindexed": 0, "rows_skipped": 0, "rows_deleted": 0}
+
+        if job:
+            job.set_stage("list_pages")
+        crawler = NotionCrawler(notion_client)
+        cursor = await run_blocking(self.load_cursor, user_id)
+        newest_seen = cursor
+        next_cursor = None
+        reached_cursor = False
+
+        while not reached_cursor:
+            response = await notion_client.search(
+                **{
+                    "filter": {"property": "object", "value": "page"},
+                    "sort": {"direction": "descending", "timestamp": "last_edited_time"},
+                    "start_cursor": next_cursor,
+                    "page_size": SEARCH_PAGE_SIZE,
+                }
+            )
+
+            pages = []
+            for page in response.get('results', []):
+                edited = parse_timestamp(page['last_edited_time'])
+                # Equal timestamps are still checked: Notion rounds last_edited_time to the minute
+                if cursor is not None and edited < cursor:
+                    reached_cursor = True
+                    break
+                pages.append((page, edited))
+                if newest_seen is None or edited > newest_seen:
+                    newest_seen = edited
+
+            stats["pages_listed"] += len(pages)
+            checkpoints = await run_blocking(self.load_checkpoints, user_id, [page['id'] for page, _ in pages]) if pages else {}
+
+            changed = []
+            for page, edited in pages:
+                checkpoint = checkpoints.get(page['id'])
+                document_id = checkpoint['document_id'] if checkpoint else None
+
+                if page.get('archived') or page.get('in_trash'):
+                    if document_id:
+                        await run_blocking(self.remove_page, user_id, document_id)
+                        stats["pages_removed"] += 1
+                    continue
+
+                if checkpoint and self.is_current(checkpoint, edited):
+                    continue
+
+                changed.append((page, document_id))
+
+            # Changed pages are crawled concurrently; the crawler's limiter paces them
+            # together, and at most NOTION_SYNC_WRITE_CONCURRENCY are written at once
+            stats["pages_changed"] += len(changed)
+            if job:
+                job.set_stage("sync_pages")
+                job.advance(pages_changed=len(changed))
+            await asyncio.gather(*(
+                self.sync_page(crawler, user_id, page, document_id, stats, job) for page, document_id in changed
+            ))
+
+            next_cursor = response.get('next_cursor')
+            if not response.get('has_more'):
+                break
+
+        if not stats["pages_failed"] and newest_seen != cursor:
+            await run_blocking(self.save_cursor, user_id, newest_seen)
+
+        return stats
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from typing import Dict, Tuple
+
+from context_builder import build_context
+from metrics import stage
+
+# Stable background sent before every reply as a person: their earliest
+# documents, packed into this many tokens. Unlike retrieved context it's the
+# same for every question, so it forms a prompt prefix Anthropic can cache.
+# Off (0) by default: it's paid on every prompt, and only cached once the
+# prefix clears agent.PROMPT_CACHE_MIN_TOKENS with its margin (~1300 here).
+PERSONA_TOKEN_BUDGET = int(os.getenv("PERSONA_TOKEN_BUDGET", "0"))
+PERSONA_DOCUMENTS = int(os.getenv("PERSONA_DOCUMENTS", "5"))
+PERSONA_CACHE_TTL_SECONDS = int(os.getenv("PERSONA_CACHE_TTL_SECONDS", str(3600)))
+# Chunks read per document; the budget usually runs out well before this
+PERSONA_CHUNKS_PER_DOCUMENT = 20
+
+
+class PersonaPrefixes:
+    """
+    Per-user persona text, built from the user's documents and kept in
+    process. The text must be byte-identical between turns for the prompt
+    cache to hit, so documents and chunks are read in a fixed order and the
+    result is reused until the user's corpus changes (invalidate()) or the
+    TTL passes.
+    """
+
+    def __init__(self, supabase, budget: int = PERSONA_TOKEN_BUDGET, ttl_seconds: int = PERSONA_CACHE_TTL_SECONDS):
+        self.supabase = supabase
+        self.budget = budget
+        self.ttl_seconds = ttl_seconds
+        self._personas: Dict[str, Tuple[float, str]] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.builds = 0
+
+    def get(self, user_id: str) -> str:
+        """
+        Returns:
+            str: The user's persona text, empty if they have no content or
+            personas are off. Blocking on a miss.
+        """
+        if self.budget <= 0:
+            return ""
+        with self._lock:
+            cached = self._personas.get(user_id)
+            if cached and cached[0] > time.time():
+                self.hits += 1
+                return cached[1]
+
+        persona = self._build(user_id)
+        with self._lock:
+            self.builds += 1
+            self._personas[user_id] = (time.time() + self.ttl_seconds, persona)
+        return persona
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._personas.pop(user_id, None)
+
+    def _build(self, user_id: str) -> str:
+        with stage("fetch_documents"):
+            documents = self.supabase.table('documents')\
+                .select('id')\
+                .eq('user_id', user_id)\
+                .order('created_at')\
+                .order('id')\
+                .limit(PERSONA_DOCUMENTS)\
+                .execute().data or []
+            if not documents:
+                return ""
+            chunks = self.supabase.table('chunks')\
+                .select('document_id, content, chunk_index')\
+                .in_('document_id', [document['id'] for document in documents])\
+                .lt('chunk_index', PERSONA_CHUNKS_PER_DOCUMENT)\
+                .execute().data or []
+
+        # Document order, then position within the document
+        rank = {document['id']: position for position, document in enumerate(documents)}
+        chunks.sort(key=lambda chunk: (rank[chunk['document_id']], chunk['chunk_index']))
+        return "\n\n".join(build_context(chunks, self.budget).documents)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.builds
+            return {
+                "hits": self.hits,
+                "builds": self.builds,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "users": len(self._personas)
+            }
@@ -0,0 +1,190 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Replies are reused for queries whose embedding is at least this similar to
+# a cached query of the same user. Users opt in (and may override the
+# threshold) through their profile; settings are re-read every few minutes.
+RESPONSE_CACHE_THRESHOLD = float(os.getenv("RESPONSE_CACHE_THRESHOLD", "0.95"))
+RESPONSE_CACHE_MAX_ENTRIES_PER_USER = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES_PER_USER", "500"))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", str(24 * 3600)))
+RESPONSE_CACHE_SETTINGS_TTL_SECONDS = 300
+
+
+@dataclass
+class CachedResponse:
+    query: str
+    reply: str
+    tokens: int
+    elapsed_ms: float
+    expires_at: float
+
+
+class UserResponses:
+    """One user's cached replies, LRU-ordered, with their query embeddings stacked for matching."""
+
+    def __init__(self):
+        self.version = 0
+        self.entries: "OrderedDict[int, CachedResponse]" = OrderedDict()
+        self.embeddings: Dict[int, np.ndarray] = {}
+        self.next_id = 0
+        self._matrix = None
+        self._ids = None
+
+    def matrix(self) -> Tuple[np.ndarray, list]:
+        if self._matrix is None:
+            self._ids = list(self.entries)
+            self._matrix = np.stack([self.embeddings[entry_id] for entry_id in self._ids]) if self._ids else None
+        return self._matrix, self._ids
+
+    def add(self, entry: CachedResponse, embedding: np.ndarray):
+        self.entries[self.next_id] = entry
+        self.embeddings[self.next_id] = embedding
+        self.next_id += 1
+        self._matrix = None
+
+    def remove(self, entry_id: int):
+        del self.entries[entry_id]
+        del self.embeddings[entry_id]
+        self._matrix = None
+
+
+class SemanticResponseCache:
+    """
+    Opt-in cache of LLM replies for public chat, matched by query similarity.
+
+    Entries belong to a target user and their corpus version: bump() drops
+    them when the user's content changes. Each user keeps at most
+    max_entries_per_user replies (least recently used go first), and replies
+    expire after ttl_seconds. Hits count the tokens and latency of the LLM
+    call they replaced.
+    """
+
+    def __init__(
+        self,
+        supabase,
+        threshold: float = RESPONSE_CACHE_THRESHOLD,
+        max_entries_per_user: int = RESPONSE_CACHE_MAX_ENTRIES_PER_USER,
+        ttl_seconds: int = RESPONSE_CACHE_TTL_SECONDS,
+    ):
+        self.supabase = supabase
+        self.threshold = threshold
+        self.max_entries_per_user = max_entries_per_user
+        self.ttl_seconds = ttl_seconds
+        self._users: Dict[str, UserResponses] = {}
+        self._settings: Dict[str, Tuple[float, bool, float]] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.tokens_saved = 0
+        self.saved_ms = 0.0
+
+    def settings(self, user_id: str) -> Tuple[bool, float]:
+        """
+        Whether the user opted in, and their similarity threshold. Blocking.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._settings.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1], cached[2]
+
+        response = self.supabase.table('profiles')\
+            .select('response_cache_enabled, response_cache_threshold')\
+            .eq('id', user_id)\
+            .execute()
+        row = response.data[0] if response.data else {}
+        enabled = bool(row.get('response_cache_enabled'))
+        threshold = row.get('response_cache_threshold') or self.threshold
+        with self._lock:
+            self._settings[user_id] = (now + RESPONSE_CACHE_SETTINGS_TTL_SECONDS, enabled, threshold)
+        return enabled, threshold
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            user = self._users.get(user_id)
+            return user.version if user else 0
+
+    def get(self, user_id: str, query_embedding: list, threshold: float) -> Optional[Tuple[CachedResponse, float]]:
+        """
+        Returns:
+            Tuple[CachedResponse, float]: The closest cached reply and its
+            similarity, or None if none is within the threshold
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        now = time.time()
+
+        with self._lock:
+            user = self._users.get(user_id)
+            if user is not None:
+                for entry_id in [entry_id for entry_id, entry in user.entries.items() if entry.expires_at <= now]:
+                    user.remove(entry_id)
+
+            matrix, ids = user.matrix() if user is not None else (None, None)
+            if matrix is None:
+                self.misses += 1
+                return None
+
+            similarities = matrix @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < threshold:
+                self.misses += 1
+                return None
+
+            entry = user.entries[ids[best]]
+            user.entries.move_to_end(ids[best])
+            self.hits += 1
+            self.tokens_saved += entry.tokens
+            self.saved_ms += entry.elapsed_ms
+            return entry, float(similarities[best])
+
+    def put(self, user_id: str, version: int, query: str, query_embedding: list, reply: str,
+            tokens: int, elapsed_ms: float):
+        """
+        Store a reply generated against the given corpus version; dropped if
+        the user's corpus changed while it was being generated.
+        """
+        embedding = np.asarray(query_embedding, dtype=np.float32)
+        embedding /= np.linalg.norm(embedding) or 1
+        entry = CachedResponse(query, reply, tokens, elapsed_ms, time.time() + self.ttl_seconds)
+
+        with self._lock:
+            user = self._users.setdefault(user_id, UserResponses())
+            if user.version != version:
+                return
+            user.add(entry, embedding)
+            while len(user.entries) > self.max_entries_per_user:
+                user.remove(next(iter(user.entries)))
+
+    def bump(self, user_id: str):
+        """Start a new corpus version for a user, dropping their cached replies."""
+        with self._lock:
+            user = self._users.get(user_id)
+            fresh = UserResponses()
+            if user is not None:
+                self.invalidations += len(user.entries)
+                fresh.version = user.version + 1
+            else:
+                fresh.version = 1
+            self._users[user_id] = fresh
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": sum(len(user.entries) for user in self._users.values()),
+                "tokens_saved": self.tokens_saved,
+                "saved_ms": round(self.saved_ms, 2)
+            }
@@ -0,0 +1,133 @@
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from context_builder import build_context
+from metrics import stage
+from retrieval_cache import RetrievalCache
+
+# Number of nearest chunks fetched from the vector index before reranking (N)
+DEFAULT_CANDIDATES = int(os.getenv("RETRIEVAL_CANDIDATES", "50"))
+
+
+@dataclass
+class RetrievalResult:
+    """
+    Output of a two-stage retrieval.
+
+    documents holds the reranked chunk texts packed into the context token
+    budget (what the LLM sees), chunks holds the reranked rows, and stats
+    carries per-stage timings, candidate counts for tuning N and context
+    packing counts.
+    """
+    documents: list = field(default_factory=list)
+    chunks: list = field(default_factory=list)
+    stats: dict = field(default_factory=dict)
+
+
+class Retriever:
+    """
+    Two-stage retriever: vector search for the top-N chunks of a user, then a
+    rerank over those candidates only. Cost depends on N, not on corpus size.
+
+    With a VectorIndex, stage 1 runs in-process; users whose local index isn't
+    built yet are searched with the match_chunks RPC. With a RetrievalCache,
+    repeated questions to the same user skip all three stages.
+    """
+
+    def __init__(self, supabase, ai_client, candidates: Optional[int] = None, vector_index=None,
+                 cache: Optional[RetrievalCache] = None):
+        self.supabase = supabase
+        self.ai_client = ai_client
+        self.candidates = candidates or DEFAULT_CANDIDATES
+        self.vector_index = vector_index
+        self.cache = cache
+
+    def search_candidates(self, user_id: str, query_embedding: list, limit: int) -> Tuple[list, str]:
+        """
+        Returns:
+            Tuple[list, str]: The nearest chunks, and which index served them ('local' or 'pgvector')
+        """
+        with stage("fetch_documents"):
+            if self.vector_index is not None:
+                rows = self.vector_index.search(user_id, query_embedding, limit)
+                if rows is not None:
+                    return rows, "local"
+
+            response = self.supabase.rpc('match_chunks', {
+                'query_embedding': query_embedding,
+                'current_user_id': user_id,
+                'match_count': limit
+            }).execute()
+            return response.data or [], "pgvector"
+
+    def retrieve(self, user_id: str, query: str, k: int = 5, candidates: Optional[int] = None) -> RetrievalResult:
+        """
+        Retrieve the k most relevant chunks of a user's corpus for a query.
+
+        Args:
+            user_id (str): Owner of the corpus to search
+            query (str): The user's message
+            k (int): Number of chunks to keep after reranking
+            candidates (int): Override for N, the number of vector candidates
+
+        Returns:
+            RetrievalResult: Reranked chunks and per-stage stats
+        """
+        limit = candidates or self.candidates
+        stats = {"candidates_requested": limit, "candidates": 0, "returned": 0}
+        started = time.perf_counter()
+
+        cache_key = self.cache.key(user_id, query, k, limit) if self.cache else None
+        if cache_key:
+            chunks = self.cache.get(cache_key)
+            if chunks is not None:
+                context = build_context(chunks)
+                stats.update(context.stats)
+                stats.update(cache="hit", returned=len(chunks), total_ms=round((time.perf_counter() - started) * 1000, 2))
+                return RetrievalResult(documents=context.documents, chunks=chunks, stats=stats)
+            stats["cache"] = "miss"
+
+        # Stage 0: embed the query
+        query_embedding = self.ai_client.embed_query(query)
+        stats["embed_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if query_embedding is None:
+            stats["total_ms"] = stats["embed_ms"]
+            return RetrievalResult(stats=stats)
+
+        # Stage 1: nearest N chunks from the vector index
+        stage_started = time.perf_counter()
+        rows, stats["vector_backend"] = self.search_candidates(user_id, query_embedding, limit)
+        stats["vector_search_ms"] = round((time.perf_counter() - stage_started) * 1000, 2)
+        stats["candidates"] = len(rows)
+
+        if not rows:
+            stats["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+            return RetrievalResult(stats=stats)
+
+        # Stage 2: rerank only the candidates
+        stage_started = time.perf_counter()
+        ranked = self.ai_client.rerank_indices([row['content'] for row in rows], query, k)
+        stats["rerank_ms"] = round((time.perf_counter() - stage_started) * 1000, 2)
+
+        if ranked:
+            chunks = [{**rows[index], 'relevance_score': score} for index, score in ranked]
+        else:
+            # Reranker unavailable: fall back to vector order
+            chunks = rows[:k]
+
+        # Pack the ranked chunks into the prompt's token budget
+        context = build_context(chunks)
+        stats.update(context.stats)
+
+        stats["returned"] = len(chunks)
+        stats["total_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if cache_key and ranked:
+            # Vector-order fallbacks aren't cached, so the next ask gets a real rerank
+            self.cache.put(cache_key, chunks, stats["total_ms"])
+        return RetrievalResult(
+            documents=context.documents,
+            chunks=chunks,
+            stats=stats
+        )
@@ -0,0 +1,107 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+# Reranked results are cached per (user, corpus version, normalized query).
+# Ingesting content for a user bumps their corpus version, which drops their
+# entries; the TTL only bounds how long an idle entry is kept.
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RETRIEVAL_CACHE_MAX_ENTRIES", "10000"))
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", str(3600)))
+
+_PUNCTUATION = re.compile(r"[^\w\s']+")
+
+
+def normalize_query(query: str) -> str:
+    # "What do you do?" and "what do you do" are the same question
+    return " ".join(_PUNCTUATION.sub(" ", query.lower()).split())
+
+
+class RetrievalCache:
+    """
+    In-process LRU of reranked retrieval results for chat queries.
+
+    Each entry keeps the reranked chunks and how long computing them took,
+    so hits can report the latency they saved. Versions live in memory, so
+    each worker process invalidates its own entries.
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES, ttl_seconds: int = RETRIEVAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, Tuple[float, list, float]]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[tuple]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.saved_ms = 0.0
+
+    def key(self, user_id: str, query: str, k: int, candidates: int) -> tuple:
+        with self._lock:
+            version = self._versions.get(user_id, 0)
+        return (user_id, version, normalize_query(query), k, candidates)
+
+    def get(self, key: tuple) -> Optional[list]:
+        """
+        Returns:
+            list: Copies of the cached reranked chunks, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.saved_ms += entry[2]
+            return [dict(chunk) for chunk in entry[1]]
+
+    def put(self, key: tuple, chunks: list, elapsed_ms: float):
+        user_id, version = key[0], key[1]
+        with self._lock:
+            # Computed against a corpus that has since changed
+            if version != self._versions.get(user_id, 0):
+                return
+            self._entries[key] = (time.time() + self.ttl_seconds, [dict(chunk) for chunk in chunks], elapsed_ms)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._forget(next(iter(self._entries)))
+
+    def bump(self, user_id: str):
+        """Start a new corpus version for a user, dropping their cached results."""
+        with self._lock:
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
+            for key in self._keys_by_user.pop(user_id, set()):
+                self._entries.pop(key, None)
+                self.invalidations += 1
+
+    def _forget(self, key: tuple):
+        # Caller holds the lock
+        self._entries.pop(key, None)
+        keys = self._keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[key[0]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "saved_ms": round(self.saved_ms, 2)
+            }
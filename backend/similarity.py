@@ -0,0 +1,127 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Storage precision for indexed embeddings. float16 halves memory and int8
+# (one scale per vector) quarters it; queries stay float32 either way.
+PRECISIONS = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+# Stored vectors are widened to float32 this many rows at a time for BLAS
+SCORE_BLOCK_SIZE = int(os.getenv("SCORE_BLOCK_SIZE", "1024"))
+
+
+def bytes_per_vector(dim: int, precision: str) -> int:
+    return dim * np.dtype(PRECISIONS[precision]).itemsize + (4 if precision == "int8" else 0)
+
+
+def quantize(vectors: np.ndarray, precision: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Encode float32 unit vectors for storage.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The stored codes, and for
+        int8 the float32 scale of each vector (None otherwise)
+    """
+    if precision != "int8":
+        return vectors.astype(PRECISIONS[precision], copy=False), None
+
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    vectors = np.asarray(codes, dtype=np.float32)
+    return vectors * scales[:, None] if scales is not None else vectors
+
+
+def scores(codes: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """
+    Dot products of float32 queries against stored vectors.
+
+    NumPy has no BLAS path for float16 or int8, so those are widened one
+    block at a time; every query in the batch shares each widened block.
+
+    Args:
+        codes: (n, dim) stored vectors
+        scales: (n,) int8 scales, or None
+        queries: (m, dim) float32 unit vectors
+
+    Returns:
+        np.ndarray: (m, n) float32 cosine similarities
+    """
+    if codes.dtype == np.float32:
+        return queries @ codes.T
+
+    out = np.empty((len(queries), len(codes)), dtype=np.float32)
+    for start in range(0, len(codes), SCORE_BLOCK_SIZE):
+        block = codes[start:start + SCORE_BLOCK_SIZE]
+        out[:, start:start + len(block)] = queries @ block.astype(np.float32).T
+    if scales is not None:
+        out *= scales
+    return out
+
+
+def top_k(similarities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Best k columns of each row, using argpartition so only the k winners are sorted.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (m, k) indices and similarities, best first
+    """
+    k = min(k, similarities.shape[1])
+    if k == 0:
+        return np.empty((len(similarities), 0), dtype=np.int64), np.empty((len(similarities), 0), dtype=np.float32)
+    if k < similarities.shape[1]:
+        indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.tile(np.arange(k), (len(similarities), 1))
+    values = np.take_along_axis(similarities, indices, axis=1)
+    order = np.argsort(-values, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(values, order, axis=1)
+
+
+if __name__ == "__main__":
+    # Exact search benchmark per storage precision: memory per million
+    # voyage-3-lite (512-dim) chunks, queries/sec for single and batched
+    # queries, and recall@k against float32 results.
+    import time
+
+    size = int(os.getenv("SIMILARITY_BENCH_N", "100000"))
+    dim = 512
+    k = 10
+    batch = 32
+    queries = 128
+    rng = np.random.default_rng(0)
+
+    def unit(count):
+        vectors = rng.standard_normal((count, dim)).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    topics = unit(max(1, size // 50))
+    # Topic direction plus noise, like topic-grouped chunk embeddings
+    vectors = topics[rng.integers(len(topics), size=size)] + 1.2 * unit(size)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query_vectors = topics[rng.integers(len(topics), size=queries)] + 1.2 * unit(queries)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    exact, _ = top_k(scores(vectors, None, query_vectors), k)
+    print(f"{size} x {dim} vectors, k={k}, {queries} queries")
+    print("-" * 78)
+    for precision in PRECISIONS:
+        codes, scales = quantize(vectors, precision)
+        per_million = bytes_per_vector(dim, precision) * 1_000_000 / 1024 / 1024
+
+        started = time.perf_counter()
+        found = [top_k(scores(codes, scales, query[None]), k)[0][0] for query in query_vectors]
+        single = queries / (time.perf_counter() - started)
+
+        started = time.perf_counter()
+        for start in range(0, queries, batch):
+            top_k(scores(codes, scales, query_vectors[start:start + batch]), k)
+        batched = queries / (time.perf_counter() - started)
+
+        recall = sum(len(set(a) & set(b)) for a, b in zip(found, exact)) / (k * queries)
+        print(f"{precision:8s} {per_million:7.0f} MB/1M chunks  recall@{k} {recall:.3f}"
+              f"  {single:6.0f} QPS single  {batched:6.0f} QPS batch {batch}")
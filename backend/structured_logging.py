@@ -0,0 +1,274 @@
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from metrics import current_trace_id
+
+# Records are queued by request handlers and written by a background thread,
+# so a slow stdout never stalls a request. When the queue is full, records
+# are dropped (and counted) rather than blocking.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Longest string kept per field, and items kept per list or dict
+LOG_MAX_FIELD_CHARS = int(os.getenv("LOG_MAX_FIELD_CHARS", "500"))
+LOG_MAX_ITEMS = int(os.getenv("LOG_MAX_ITEMS", "20"))
+# Share of requests per path whose INFO/DEBUG records are kept, e.g.
+# "/functions/v1/public-chat=0.05,/api/process-message=0.5". Warnings and
+# errors are always kept.
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+# Never logged, whatever the route
+SECRET_FIELDS = frozenset({"access_token", "notion_token", "authorization", "password", "api_key"})
+
+
+@dataclass(frozen=True)
+class RoutePolicy:
+    sample_rate: float = 1.0
+    # Field names logged as their length only
+    redact: frozenset = SECRET_FIELDS
+
+
+# Public chat is the busiest route and carries visitors' messages, so by
+# default one request in ten is logged and message text is left out
+ROUTE_POLICIES: Dict[str, RoutePolicy] = {
+    "/functions/v1/public-chat": RoutePolicy(0.1, SECRET_FIELDS | {"content", "reply", "query", "cached_query"}),
+}
+_DEFAULT_POLICY = RoutePolicy()
+
+
+@dataclass(frozen=True)
+class _RequestLogging:
+    sampled: bool
+    redact: frozenset
+
+
+_OUTSIDE_REQUEST = _RequestLogging(True, SECRET_FIELDS)
+_current: "contextvars.ContextVar[_RequestLogging]" = contextvars.ContextVar("request_logging", default=_OUTSIDE_REQUEST)
+
+
+def _parse_sample_rates(spec: str):
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        path, _, rate = item.rpartition("=")
+        policy = ROUTE_POLICIES.get(path, _DEFAULT_POLICY)
+        ROUTE_POLICIES[path] = RoutePolicy(float(rate), policy.redact)
+
+
+_parse_sample_rates(LOG_SAMPLE_RATES)
+
+
+def log_event(logger: logging.Logger, level: int, event: str, **fields):
+    """
+    Log an event with structured fields. Nothing is formatted here: if the
+    level is disabled or the request wasn't sampled this returns at once,
+    and truncation, redaction and JSON encoding happen on the writer thread.
+    """
+    if level < logging.WARNING and not _current.get().sampled:
+        return
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def _clip(value, redact: frozenset, depth: int = 0):
+    if isinstance(value, str):
+        if len(value) > LOG_MAX_FIELD_CHARS:
+            return f"{value[:LOG_MAX_FIELD_CHARS]}...(+{len(value) - LOG_MAX_FIELD_CHARS} chars)"
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if depth >= 3:
+        return _clip(repr(value), redact, depth)
+    if isinstance(value, dict):
+        clipped = {}
+        for index, (key, item) in enumerate(value.items()):
+            if index == LOG_MAX_ITEMS:
+                clipped["..."] = f"+{len(value) - LOG_MAX_ITEMS} keys"
+                break
+            clipped[str(key)] = _redacted(item) if str(key).lower() in redact else _clip(item, redact, depth + 1)
+        return clipped
+    if isinstance(value, (list, tuple, set)):
+        items = list(value)
+        clipped = [_clip(item, redact, depth + 1) for item in items[:LOG_MAX_ITEMS]]
+        if len(items) > LOG_MAX_ITEMS:
+            clipped.append(f"...(+{len(items) - LOG_MAX_ITEMS} items)")
+        return clipped
+    return _clip(str(value), redact, depth)
+
+
+def _redacted(value) -> str:
+    return f"[redacted {len(value)} chars]" if isinstance(value, str) else "[redacted]"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, event, trace id and fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        redact = getattr(record, "redact", SECRET_FIELDS)
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "event": _clip(record.getMessage(), redact),
+        }
+        trace_id = getattr(record, "trace_id", None)
+        if trace_id:
+            entry["trace_id"] = trace_id
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(_clip(fields, redact))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _RequestFilter(logging.Filter):
+    # Runs on the calling thread, before the record is queued: drops
+    # unsampled records and stamps the request's trace id and redaction set
+    def filter(self, record: logging.LogRecord) -> bool:
+        request = _current.get()
+        if record.levelno < logging.WARNING and not request.sampled:
+            return False
+        record.trace_id = current_trace_id()
+        record.redact = request.redact
+        return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the listener; only pin down the message and
+        # the exception text, which can't be rebuilt on another thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+
+class _ReportingStreamHandler(logging.StreamHandler):
+    # Writes records and reports how many were dropped since the last write
+    def __init__(self, stream, queue_handler: _DroppingQueueHandler):
+        super().__init__(stream)
+        self.queue_handler = queue_handler
+        self.reported = 0
+
+    def emit(self, record: logging.LogRecord):
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported:
+            notice = logging.LogRecord(__name__, logging.WARNING, __file__, 0, "log_records_dropped", None, None)
+            notice.fields = {"dropped": dropped - self.reported, "queue_size": LOG_QUEUE_SIZE}
+            self.reported = dropped
+            super().emit(notice)
+        super().emit(record)
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(stream=None):
+    """
+    Route the root logger through the async JSON handler. Safe to call more
+    than once; uvicorn's own loggers are left alone.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(_RequestFilter())
+    writer = _ReportingStreamHandler(stream or sys.stdout, queue_handler)
+    writer.setFormatter(JsonFormatter())
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(queue_handler)
+    _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Write out queued records; called on application shutdown."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def request_policy(path: str) -> RoutePolicy:
+    return ROUTE_POLICIES.get(path.rstrip("/") or "/", _DEFAULT_POLICY)
+
+
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware deciding once per request, from its path's policy,
+    whether its INFO/DEBUG records are kept and which fields are redacted.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        policy = request_policy(scope["path"])
+        sampled = policy.sample_rate >= 1 or random.random() < policy.sample_rate
+        token = _current.set(_RequestLogging(sampled, policy.redact))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+
+if __name__ == "__main__":
+    # Cost per request of logging the chat handler's payloads: the previous
+    # synchronous prints of the full body and reply versus queued, clipped
+    # records, for growing payloads (stdout redirected to /dev/null).
+    logger = logging.getLogger("bench")
+    sink = open(os.devnull, "w")
+    configure_logging(sink)
+    requests = 2000
+
+    for size in (1_000, 100_000, 1_000_000):
+        body = {"user_id": "u", "conversation_id": 1, "content": "x" * size}
+        reply = "y" * size
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            print(f"Raw request body: {body}", file=sink)
+            print(f"Generated bot response: {reply}", file=sink)
+        printed = (time.perf_counter() - started) / requests * 1e6
+
+        started = time.perf_counter()
+        for _ in range(requests):
+            log_event(logger, logging.INFO, "chat_request", **body)
+            log_event(logger, logging.INFO, "bot_reply", reply=reply)
+        queued = (time.perf_counter() - started) / requests * 1e6
+
+        print(f"{size:>9} chars  print {printed:9.1f} us/request  log_event {queued:6.1f} us/request")
+
+    shutdown_logging()
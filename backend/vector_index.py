@@ -0,0 +1,703 @@
+import json
+import logging
+import math
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from similarity import PRECISIONS, dequantize, quantize, scores, top_k
+
+logger = logging.getLogger(__name__)
+
+# Optional in-process ANN index over each user's chunk embeddings, used by the
+# Retriever instead of the match_chunks RPC. Unset disables it. Vectors live in
+# memory-mapped .npy files under this directory, chunk rows in a SQLite file.
+# The files belong to one process: run a single worker per directory.
+VECTOR_INDEX_DIR = os.getenv("VECTOR_INDEX_DIR")
+# IVF lists scanned per query; higher is slower with better recall
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+# Below this many vectors a user's index is searched exhaustively
+VECTOR_INDEX_MIN_IVF = int(os.getenv("VECTOR_INDEX_MIN_IVF", "10000"))
+# Storage precision of indexed vectors: float32, float16 or int8 (see similarity.py)
+VECTOR_INDEX_PRECISION = os.getenv("VECTOR_INDEX_PRECISION", "float32")
+# Re-cluster once this fraction of vectors was added (or deleted) since the last
+# build; compact deleted vectors away once they're this fraction of the file
+VECTOR_INDEX_REBUILD_FRACTION = 0.2
+# Chunks written or deleted outside the backend (the voyage edge function, the
+# frontend) don't reach the index, so at most this often a search compares a
+# user's index with the chunks table and rebuilds it if they differ
+VECTOR_INDEX_RECONCILE_SECONDS = int(os.getenv("VECTOR_INDEX_RECONCILE_SECONDS", "600"))
+
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+# Rows per request when building a user's index from the chunks table
+LOAD_PAGE_SIZE = 500
+# Vectors scored per matmul when assigning them to lists
+ASSIGN_BLOCK_SIZE = 16384
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def parse_embedding(value) -> list:
+    # PostgREST returns vector columns as '[0.1,0.2,...]' strings
+    return json.loads(value) if isinstance(value, str) else value
+
+
+def list_count(vector_count: int) -> int:
+    # ~2 sqrt(n) lists keeps lists short enough for sub-millisecond probes
+    return max(1, int(2 * math.sqrt(vector_count)))
+
+
+def train_ivf(codes: np.ndarray, scales: Optional[np.ndarray], nlist: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Cluster stored unit vectors with spherical k-means on a sample.
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (nlist, dim) centroids, and the list of every vector
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(codes), nlist * KMEANS_SAMPLE_PER_LIST)
+    picked = np.sort(rng.choice(len(codes), sample_size, replace=False))
+    sample = dequantize(codes[picked], scales[picked] if scales is not None else None)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        counts = np.bincount(labels, minlength=nlist)
+        filled = counts > 0
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        sums = np.add.reduceat(sample[np.argsort(labels, kind='stable')], starts[filled], axis=0)
+        centroids[filled] = normalize(sums)
+        # Empty lists restart from random sample points
+        centroids[~filled] = sample[rng.choice(len(sample), int((~filled).sum()))]
+
+    labels = np.concatenate([
+        # Per-vector int8 scales are positive, so they never change the nearest centroid
+        np.argmax(scores(codes[start:start + ASSIGN_BLOCK_SIZE], None, centroids), axis=0)
+        for start in range(0, len(codes), ASSIGN_BLOCK_SIZE)
+    ])
+    return centroids, labels
+
+
+class UserIndex:
+    """
+    One user's vectors: an append-only log plus an IVF over a prefix of it.
+
+    vectors.npy holds every vector in insertion order (its row is the
+    position), stored at the index precision; int8 vectors keep their
+    scales in scales.npy. The IVF files hold a copy of the first built_count
+    vectors grouped by list, so each probed list is one contiguous matmul.
+    Vectors added since are scanned exhaustively, and deleted positions are
+    masked out until the next rebuild compacts them away.
+    """
+
+    def __init__(self, path: str, dim: int, precision: str = VECTOR_INDEX_PRECISION):
+        self.path = path
+        self.dim = dim
+        self.precision = precision
+        self.lock = threading.RLock()
+        self.ready = False
+        self.count = 0
+        self.built_count = 0
+        self.vectors = None
+        self.scales = None
+        self.alive = np.zeros(0, dtype=bool)
+        self.ivf = None
+        # Last comparison with the chunks table, and the newest chunk id seen
+        # then (None after the backend's own writes, until the next one)
+        self.checked_at = 0.0
+        self.max_chunk_id = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _save(self, name: str, array: np.ndarray):
+        np.save(self._file(name + '.tmp.npy'), array)
+        os.replace(self._file(name + '.tmp.npy'), self._file(name + '.npy'))
+
+    def _write(self, name: str, codes: np.ndarray, scales: Optional[np.ndarray], capacity: int, rows=None):
+        """
+        Write vectors (all of them, or the given rows) to a new memory-mapped file pair.
+
+        Returns:
+            Tuple[np.memmap, Optional[np.memmap]]: The new codes and scales
+        """
+        targets = [(name, codes, PRECISIONS[self.precision], (capacity, self.dim))]
+        if self.precision == "int8":
+            targets.append((name.replace('vectors', 'scales'), scales, np.float32, (capacity,)))
+
+        written = []
+        for target, source, dtype, shape in targets:
+            array = np.lib.format.open_memmap(self._file(target + '.tmp.npy'), mode='w+', dtype=dtype, shape=shape)
+            count = len(rows) if rows is not None else len(source)
+            for start in range(0, count, ASSIGN_BLOCK_SIZE):
+                end = min(start + ASSIGN_BLOCK_SIZE, count)
+                array[start:end] = source[rows[start:end] if rows is not None else slice(start, end)]
+            array.flush()
+            os.replace(self._file(target + '.tmp.npy'), self._file(target + '.npy'))
+            written.append(array)
+        return written[0], written[1] if len(written) > 1 else None
+
+    def _load(self, name: str, mode: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        codes = np.load(self._file(name + '.npy'), mmap_mode=mode)
+        if self.precision != "int8":
+            return codes, None
+        return codes, np.load(self._file(name.replace('vectors', 'scales') + '.npy'), mmap_mode=mode)
+
+    def open(self, count: int, built_count: int, positions: Iterable[int]):
+        os.makedirs(self.path, exist_ok=True)
+        self.count = count
+        self.built_count = 0
+        if os.path.exists(self._file('vectors.npy')):
+            self.vectors, self.scales = self._load('vectors', 'r+')
+        else:
+            empty = np.empty((0, self.dim), dtype=PRECISIONS[self.precision])
+            self.vectors, self.scales = self._write('vectors', empty, np.empty(0, dtype=np.float32), 1024)
+        self.alive = np.zeros(len(self.vectors), dtype=bool)
+        self.alive[np.fromiter(positions, dtype=np.int64)] = True
+
+        if built_count and os.path.exists(self._file('ivf_vectors.npy')):
+            self.ivf = (
+                np.load(self._file('ivf_centroids.npy'), mmap_mode='r'),
+                np.load(self._file('ivf_offsets.npy'), mmap_mode='r'),
+                np.load(self._file('ivf_positions.npy'), mmap_mode='r'),
+                *self._load('ivf_vectors', 'r')
+            )
+            self.built_count = built_count
+
+    def append(self, vectors: np.ndarray) -> int:
+        # Caller holds the lock; returns the position of the first appended vector
+        start = self.count
+        needed = start + len(vectors)
+        if needed > len(self.vectors):
+            capacity = max(needed, 2 * len(self.vectors))
+            self.vectors, self.scales = self._write(
+                'vectors', self.vectors[:start], self.scales[:start] if self.scales is not None else None, capacity
+            )
+            self.alive = np.concatenate((self.alive, np.zeros(capacity - len(self.alive), dtype=bool)))
+
+        codes, scales = quantize(vectors, self.precision)
+        self.vectors[start:needed] = codes
+        if scales is not None:
+            self.scales[start:needed] = scales
+        self.alive[start:needed] = True
+        self.count = needed
+        return start
+
+    def live_count(self) -> int:
+        return int(self.alive[:self.count].sum())
+
+    def needs_rebuild(self) -> bool:
+        live = self.live_count()
+        dead = self.count - live
+        # Deleted vectors are still scanned and stored, with or without an IVF
+        if dead > VECTOR_INDEX_REBUILD_FRACTION * self.count:
+            return True
+        if live < VECTOR_INDEX_MIN_IVF:
+            return self.ivf is not None
+        changed = self.count - self.built_count + dead
+        return self.ivf is None or changed > VECTOR_INDEX_REBUILD_FRACTION * self.built_count
+
+    def rebuild(self) -> np.ndarray:
+        """
+        Compact out deleted vectors and re-cluster. Caller holds the lock.
+
+        Returns:
+            np.ndarray: The new position of every old position (-1 if deleted)
+        """
+        live = np.flatnonzero(self.alive[:self.count])
+        remap = np.full(self.count, -1, dtype=np.int64)
+        remap[live] = np.arange(len(live))
+
+        if len(live) < self.count:
+            self.vectors, self.scales = self._write('vectors', self.vectors, self.scales, max(1024, len(live)), rows=live)
+            self.alive = np.zeros(len(self.vectors), dtype=bool)
+            self.alive[:len(live)] = True
+            self.count = len(live)
+
+        if self.count < VECTOR_INDEX_MIN_IVF:
+            self.ivf = None
+            self.built_count = 0
+            return remap
+
+        stored_scales = self.scales[:self.count] if self.scales is not None else None
+        nlist = list_count(self.count)
+        centroids, labels = train_ivf(self.vectors[:self.count], stored_scales, nlist)
+        order = np.argsort(labels, kind='stable').astype(np.int64)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=nlist)))).astype(np.int64)
+        grouped, grouped_scales = self._write('ivf_vectors', self.vectors, self.scales, self.count, rows=order)
+
+        self._save('ivf_centroids', centroids)
+        self._save('ivf_offsets', offsets)
+        self._save('ivf_positions', order)
+        self.ivf = (centroids, offsets, order, grouped, grouped_scales)
+        self.built_count = self.count
+        return remap
+
+    def search(self, query: np.ndarray, k: int, nprobe: int) -> List[Tuple[int, float]]:
+        """
+        Returns:
+            List[Tuple[int, float]]: Up to k (position, cosine similarity), best first
+        """
+        queries = query[None].astype(np.float32)
+        with self.lock:
+            similarities, positions = [], []
+            if self.ivf is not None:
+                centroids, offsets, ivf_positions, ivf_vectors, ivf_scales = self.ivf
+                centroid_scores = centroids @ query
+                if nprobe < len(centroids):
+                    probes = np.argpartition(-centroid_scores, nprobe)[:nprobe]
+                else:
+                    probes = range(len(centroids))
+                for probe in probes:
+                    start, end = offsets[probe], offsets[probe + 1]
+                    if end > start:
+                        list_scales = ivf_scales[start:end] if ivf_scales is not None else None
+                        similarities.append(scores(ivf_vectors[start:end], list_scales, queries)[0])
+                        positions.append(ivf_positions[start:end])
+
+            if self.count > self.built_count:
+                tail_scales = self.scales[self.built_count:self.count] if self.scales is not None else None
+                similarities.append(scores(self.vectors[self.built_count:self.count], tail_scales, queries)[0])
+                positions.append(np.arange(self.built_count, self.count))
+
+            if not similarities:
+                return []
+            similarities = np.concatenate(similarities)
+            positions = np.concatenate(positions)
+            similarities[~self.alive[positions]] = -np.inf
+
+        top, values = top_k(similarities[None], k)
+        return [(int(positions[i]), float(value)) for i, value in zip(top[0], values[0]) if value > -np.inf]
+
+
+class IndexObserver:
+    """Keeps a user's index in step with ChunkWriter's writes for one document source."""
+
+    def __init__(self, index: "VectorIndex", user_id: str, source: str):
+        self.index = index
+        self.user_id = user_id
+        self.source = source
+
+    def added(self, rows: List[dict]):
+        self.index.add(self.user_id, self.source, rows)
+
+    def moved(self, rows: List[dict]):
+        self.index.move(self.user_id, rows)
+
+    def removed(self, document_id: str, hashes: Iterable[str]):
+        self.index.remove(self.user_id, document_id, hashes)
+
+
+class VectorIndex:
+    """
+    Per-user IVF indexes over chunk embeddings, memory-mapped from disk.
+
+    A user's index is built in the background from the chunks table the first
+    time they're searched; until it's ready search() returns None and callers
+    fall back to pgvector. After that, ChunkWriter keeps it current through an
+    IndexObserver, and removed documents are dropped from it. Writes that
+    bypass the backend are caught by a periodic reconcile against the table.
+    """
+
+    def __init__(self, supabase, directory: str = VECTOR_INDEX_DIR, nprobe: int = VECTOR_INDEX_NPROBE,
+                 precision: str = VECTOR_INDEX_PRECISION):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unsupported vector index precision: {precision}")
+        self.supabase = supabase
+        self.directory = directory
+        self.nprobe = nprobe
+        self.precision = precision
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._users: Dict[str, UserIndex] = {}
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite3'), check_same_thread=False)
+        self._db.execute(
+            "create table if not exists index_state ("
+            " user_id text primary key, dim integer not null, precision text not null,"
+            " count integer not null, built_count integer not null)"
+        )
+        self._db.execute(
+            "create table if not exists index_rows ("
+            " user_id text not null, position integer not null, document_id text not null,"
+            " content_hash text not null, chunk_index integer, source text, content text not null,"
+            " primary key (user_id, position), unique (user_id, document_id, content_hash))"
+        )
+        self._db.commit()
+
+        self.searches = 0
+        self.fallbacks = 0
+        self.builds = 0
+        self.reconciles = 0
+
+    def _path(self, user_id: str) -> str:
+        return os.path.join(self.directory, user_id)
+
+    def _save_state(self, user_id: str, index: UserIndex):
+        with self._db_lock:
+            self._db.execute(
+                "insert or replace into index_state (user_id, dim, precision, count, built_count) values (?, ?, ?, ?, ?)",
+                (user_id, index.dim, index.precision, index.count, index.built_count)
+            )
+            self._db.commit()
+
+    def _get(self, user_id: str) -> Optional[UserIndex]:
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                return index
+
+            with self._db_lock:
+                state = self._db.execute(
+                    "select dim, count, built_count from index_state where user_id = ? and precision = ?",
+                    (user_id, self.precision)
+                ).fetchone()
+                positions = [row[0] for row in self._db.execute(
+                    "select position from index_rows where user_id = ?", (user_id,)
+                )] if state else []
+            if state is None:
+                # Not built yet, or stored at another precision: rebuilt on the next search
+                return None
+
+            dim, count, built_count = state
+            index = UserIndex(self._path(user_id), dim, self.precision)
+            index.open(count, built_count, positions)
+            index.ready = True
+            self._users[user_id] = index
+            return index
+
+    def search(self, user_id: str, query_embedding: list, limit: int) -> Optional[list]:
+        """
+        Nearest chunks of a user's corpus, in the same shape as match_chunks rows.
+
+        Returns:
+            list: Rows with document_id, content, chunk_index, similarity and
+            source, or None if the user's index isn't ready yet
+        """
+        index = self._get(user_id)
+        if index is None or not index.ready:
+            self.fallbacks += 1
+            if index is None:
+                self.build_in_background(user_id)
+            return None
+
+        # Held across the row lookup so a rebuild can't renumber positions in between
+        with index.lock:
+            if not index.ready:
+                # Dropped by a reconcile while waiting for the lock
+                self.fallbacks += 1
+                return None
+            hits = index.search(normalize(query_embedding), limit, self.nprobe)
+            rows = self._rows(user_id, [position for position, _ in hits]) if hits else {}
+            reconcile = time.time() - index.checked_at > VECTOR_INDEX_RECONCILE_SECONDS
+            if reconcile:
+                index.checked_at = time.time()
+        if reconcile:
+            threading.Thread(target=self._reconcile, args=(user_id, index), daemon=True).start()
+        self.searches += 1
+        return [{**rows[position], 'similarity': score} for position, score in hits if position in rows]
+
+    def _rows(self, user_id: str, positions: List[int]) -> Dict[int, dict]:
+        placeholders = ','.join('?' * len(positions))
+        with self._db_lock:
+            return {
+                row[0]: {'document_id': row[1], 'content_hash': row[2], 'chunk_index': row[3],
+                         'source': row[4], 'content': row[5]}
+                for row in self._db.execute(
+                    "select position, document_id, content_hash, chunk_index, source, content from index_rows"
+                    f" where user_id = ? and position in ({placeholders})",
+                    (user_id, *positions)
+                )
+            }
+
+    def add(self, user_id: str, source: str, rows: List[dict]):
+        """
+        Add chunk rows (document_id, content_hash, content, chunk_index,
+        embeddings) to a user's index. Ignored until the index exists; the
+        background build reads them from the chunks table instead.
+        """
+        index = self._get(user_id)
+        if index is None or not rows:
+            return
+
+        with index.lock:
+            if index.vectors is None:
+                return
+            self._insert(user_id, index, source, rows)
+            self._maintain(user_id, index)
+
+    def _insert(self, user_id: str, index: UserIndex, source: Optional[str], rows: List[dict]):
+        # Caller holds index.lock; rows already in the index are skipped
+        fresh = []
+        with self._db_lock:
+            for row in rows:
+                exists = self._db.execute(
+                    "select 1 from index_rows where user_id = ? and document_id = ? and content_hash = ?",
+                    (user_id, row['document_id'], row['content_hash'])
+                ).fetchone()
+                if not exists:
+                    fresh.append(row)
+        if not fresh:
+            return
+
+        start = index.append(normalize([parse_embedding(row['embeddings']) for row in fresh]))
+        index.max_chunk_id = None
+        with self._db_lock:
+            self._db.executemany(
+                "insert into index_rows (user_id, position, document_id, content_hash, chunk_index, source, content)"
+                " values (?, ?, ?, ?, ?, ?, ?)",
+                [(user_id, start + offset, row['document_id'], row['content_hash'], row.get('chunk_index'),
+                  row.get('source', source), row['content'])
+                 for offset, row in enumerate(fresh)]
+            )
+            self._db.commit()
+
+    def move(self, user_id: str, rows: List[dict]):
+        if user_id not in self._users:
+            return
+        with self._db_lock:
+            self._db.executemany(
+                "update index_rows set chunk_index = ? where user_id = ? and document_id = ? and content_hash = ?",
+                [(row['chunk_index'], user_id, row['document_id'], row['content_hash']) for row in rows]
+            )
+            self._db.commit()
+
+    def remove(self, user_id: str, document_id: str, hashes: Optional[Iterable[str]] = None):
+        """
+        Remove a document's chunks from a user's index, or only those with the given hashes.
+        """
+        index = self._get(user_id)
+        if index is None:
+            return
+
+        with index.lock:
+            with self._db_lock:
+                if hashes is None:
+                    positions = [row[0] for row in self._db.execute(
+                        "select position from index_rows where user_id = ? and document_id = ?", (user_id, document_id)
+                    )]
+                    self._db.execute("delete from index_rows where user_id = ? and document_id = ?", (user_id, document_id))
+                else:
+                    positions = []
+                    for content_hash in hashes:
+                        row = self._db.execute(
+                            "select position from index_rows where user_id = ? and document_id = ? and content_hash = ?",
+                            (user_id, document_id, content_hash)
+                        ).fetchone()
+                        if row:
+                            positions.append(row[0])
+                    self._db.executemany(
+                        "delete from index_rows where user_id = ? and position = ?",
+                        [(user_id, position) for position in positions]
+                    )
+                self._db.commit()
+            if positions and index.vectors is not None:
+                index.alive[positions] = False
+                index.max_chunk_id = None
+                self._maintain(user_id, index)
+
+    def _maintain(self, user_id: str, index: UserIndex):
+        # Caller holds index.lock. Indexes still being built are saved once the build finishes.
+        if not index.ready:
+            return
+        if index.needs_rebuild():
+            self._rebuild(user_id, index)
+        self._save_state(user_id, index)
+
+    def _rebuild(self, user_id: str, index: UserIndex):
+        remap = index.rebuild()
+        old = np.flatnonzero((remap != -1) & (remap != np.arange(len(remap))))
+        with self._db_lock:
+            # Positions only ever move down, so renumbering in ascending order never collides
+            self._db.executemany(
+                "update index_rows set position = ? where user_id = ? and position = ?",
+                [(int(remap[position]), user_id, int(position)) for position in old]
+            )
+            self._db.commit()
+
+    def build_in_background(self, user_id: str):
+        with self._lock:
+            if user_id in self._users:
+                return
+            # Chunks written before the build thread takes the lock are picked up from the table
+            index = UserIndex(self._path(user_id), 0, self.precision)
+            self._users[user_id] = index
+        threading.Thread(target=self._build, args=(user_id, index), daemon=True).start()
+
+    def load_chunks(self, user_id: str) -> Iterable[List[dict]]:
+        # Page through a user's chunks with their document source
+        offset = 0
+        while True:
+            response = self.supabase.table('chunks')\
+                .select('id, document_id, content_hash, content, chunk_index, embeddings, documents!inner(user_id, scrape_source)')\
+                .eq('documents.user_id', user_id)\
+                .order('id')\
+                .range(offset, offset + LOAD_PAGE_SIZE - 1)\
+                .execute()
+            rows = response.data or []
+            if rows:
+                yield rows
+            if len(rows) < LOAD_PAGE_SIZE:
+                return
+            offset += LOAD_PAGE_SIZE
+
+    def _build(self, user_id: str, index: UserIndex):
+        # Runs on its own thread; writes that arrive meanwhile wait on the lock
+        started = time.perf_counter()
+        index.lock.acquire()
+        try:
+            index.checked_at = time.time()
+            max_chunk_id = None
+            shutil.rmtree(index.path, ignore_errors=True)
+            with self._db_lock:
+                self._db.execute("delete from index_rows where user_id = ?", (user_id,))
+                self._db.commit()
+
+            for page in self.load_chunks(user_id):
+                rows = [
+                    {**row, 'source': row['documents']['scrape_source']}
+                    for row in page if row.get('embeddings') is not None
+                ]
+                if not rows:
+                    continue
+                max_chunk_id = rows[-1]['id']
+                if index.vectors is None:
+                    index.dim = len(parse_embedding(rows[0]['embeddings']))
+                    index.open(0, 0, [])
+                self._insert(user_id, index, None, rows)
+
+            if index.vectors is None:
+                # Nothing indexed yet; try again on a later search
+                with self._lock:
+                    self._users.pop(user_id, None)
+                return
+
+            index.ready = True
+            index.max_chunk_id = max_chunk_id
+            self._maintain(user_id, index)
+            self.builds += 1
+            logger.info(f"Built vector index for user {user_id}: {index.count} chunks in {time.perf_counter() - started:.1f}s")
+        except Exception as e:
+            logger.error(f"Error building vector index for user {user_id}: {e}")
+            with self._lock:
+                self._users.pop(user_id, None)
+        finally:
+            index.lock.release()
+
+    def _reconcile(self, user_id: str, index: UserIndex):
+        """
+        Rebuild a user's index if the chunks table holds a different number of
+        embedded chunks, or a different newest chunk, than the index does.
+        """
+        try:
+            response = self.supabase.table('chunks')\
+                .select('id, documents!inner(user_id)', count='exact')\
+                .eq('documents.user_id', user_id)\
+                .not_.is_('embeddings', 'null')\
+                .order('id', desc=True)\
+                .limit(1)\
+                .execute()
+            table_count = response.count or 0
+            max_chunk_id = response.data[0]['id'] if response.data else None
+
+            with index.lock:
+                if not index.ready:
+                    return
+                live = index.live_count()
+                if live == table_count and index.max_chunk_id in (None, max_chunk_id):
+                    index.max_chunk_id = max_chunk_id
+                    return
+                # Stale: retire this index so pending writes and searches skip it
+                index.ready = False
+                index.vectors = index.scales = index.ivf = None
+                with self._lock:
+                    if self._users.get(user_id) is index:
+                        del self._users[user_id]
+            self.reconciles += 1
+            logger.info(f"Rebuilding vector index for user {user_id}: {live} indexed chunks, {table_count} in the table")
+            self.build_in_background(user_id)
+        except Exception as e:
+            logger.error(f"Error reconciling vector index for user {user_id}: {e}")
+
+    def observer(self, user_id: str, source: str) -> IndexObserver:
+        return IndexObserver(self, user_id, source)
+
+    def stats(self) -> dict:
+        with self._lock:
+            users = list(self._users.values())
+        return {
+            "precision": self.precision,
+            "users_loaded": len(users),
+            "users_ready": sum(1 for index in users if index.ready),
+            "vectors": sum(index.count for index in users),
+            "searches": self.searches,
+            "fallbacks": self.fallbacks,
+            "builds": self.builds,
+            "reconciles": self.reconciles
+        }
+
+
+if __name__ == "__main__":
+    # Recall and throughput benchmark: IVF search over a synthetic corpus of
+    # clustered unit vectors (like topic-grouped chunk embeddings) against
+    # exhaustive NumPy search, which gives the exact top-k.
+    import tempfile
+
+    size = int(os.getenv("VECTOR_BENCH_N", "100000"))
+    dim = int(os.getenv("VECTOR_BENCH_DIM", "512"))
+    k = 10
+    queries = 200
+    rng = np.random.default_rng(0)
+
+    def clustered(count):
+        # Topic direction plus noise of norm ~1.2: neighbours share a topic but aren't trivially separable
+        return normalize(topics[rng.integers(len(topics), size=count)] + rng.standard_normal((count, dim)) * 1.2 / math.sqrt(dim))
+
+    topics = normalize(rng.standard_normal((max(1, size // 50), dim)))
+    vectors = clustered(size)
+    query_vectors = clustered(queries)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index = UserIndex(directory, dim, VECTOR_INDEX_PRECISION)
+        index.open(0, 0, [])
+        started = time.perf_counter()
+        for start in range(0, size, 256):
+            index.append(vectors[start:start + 256])
+        appended = time.perf_counter() - started
+        started = time.perf_counter()
+        index.rebuild()
+        built = time.perf_counter() - started
+        print(f"{size} x {dim} {VECTOR_INDEX_PRECISION} vectors: appended in {appended:.1f}s, {list_count(size)} lists built in {built:.1f}s")
+        print("-" * 60)
+
+        exact = []
+        started = time.perf_counter()
+        for query in query_vectors:
+            top, _ = top_k(scores(vectors, None, query[None]), k)
+            exact.append(set(top[0].tolist()))
+        elapsed = time.perf_counter() - started
+        print(f"Brute force:  recall@{k} 1.000, {queries / elapsed:8.0f} QPS, {elapsed / queries * 1000:.3f} ms/query")
+
+        for nprobe in (4, 8, 16, 32, 64):
+            found = 0
+            latencies = []
+            for query, truth in zip(query_vectors, exact):
+                started = time.perf_counter()
+                hits = index.search(query, k, nprobe)
+                latencies.append(time.perf_counter() - started)
+                found += len(truth & {position for position, _ in hits})
+            latencies.sort()
+            print(f"IVF nprobe {nprobe:2d}: recall@{k} {found / (k * queries):.3f}, {queries / sum(latencies):8.0f} QPS,"
+                  f" p50 {latencies[len(latencies) // 2] * 1000:.3f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.3f} ms")
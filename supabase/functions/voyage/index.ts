@@ -45,8 +45,9 @@ async function insertDocumentAndChunks(text: string, userId: string, source: str
   // Remove URLs from the text
   const textWithoutUrls = text.replace(urlRegex, '');
 
-  // Split the text into chunks of 3000 tokens
-  const textChunks = chunkText(textWithoutUrls, 3000);
+  // Split the text into chunks of 3000 tokens; chunks are unique per document
+  // (the database hashes their content), so repeated slices are stored once
+  const textChunks = [...new Set(chunkText(textWithoutUrls, 3000))];
   
   // Send all text chunks at once
   const response = await client.embed({
@@ -0,0 +1,47 @@
+-- Migration: create match_chunks for two-stage retrieval
+--
+-- match_documents_only hardcodes limit 10 and only searches a subset of
+-- scrape sources, which excludes content added through /api/add-content
+-- ('user'). The chat endpoints need a tunable candidate count (N) over the
+-- whole corpus of the target user, so this function takes the limit as an
+-- argument and optionally filters by source. Results are re-ranked in the
+-- backend, so the function only has to return the nearest N chunks.
+
+create or replace function public.match_chunks(
+  query_embedding vector(512),       -- the embedding vector for the query (input_type = 'query')
+  current_user_id uuid,              -- the owner of the chunks to search
+  match_count int default 50,        -- number of candidates (N) to return
+  source_filter text default null    -- optional documents.scrape_source filter
+)
+returns table (
+  id bigint,                         -- chunk id
+  document_id uuid,                  -- document the chunk belongs to
+  content text,                      -- chunk content
+  chunk_index int,                   -- position of the chunk inside its document
+  similarity float,                  -- cosine similarity to the query
+  source text                        -- documents.scrape_source
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  select
+    chunks.id,
+    chunks.document_id,
+    chunks.content,
+    chunks.chunk_index,
+    1 - (chunks.embeddings <=> query_embedding) as similarity,
+    documents.scrape_source as source
+  from public.chunks as chunks
+  join public.documents as documents on chunks.document_id = documents.id
+  where documents.user_id = current_user_id
+    and chunks.embeddings is not null
+    and (source_filter is null or documents.scrape_source = source_filter)
+  -- order by the distance operator directly so the ivfflat index can be used
+  order by chunks.embeddings <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+grant execute on function public.match_chunks(vector, uuid, int, text) to authenticated, service_role;
@@ -0,0 +1,49 @@
+-- Migration: checkpoints for incremental Notion sync
+--
+-- /sync/notion used to re-extract every visible page and store the result as
+-- one new document per sync. Each Notion page now maps to its own document,
+-- and these tables record what was last synced so unchanged pages are skipped:
+--   notion_sync_state       one row per user, the newest last_edited_time seen
+--   notion_page_checkpoints one row per synced page, with its document
+
+create table public.notion_sync_state (
+    user_id uuid primary key references auth.users (id) on delete cascade,
+    last_edited_cursor timestamp with time zone,  -- newest page last_edited_time fully synced
+    synced_at timestamp with time zone default timezone('utc'::text, now()) not null
+);
+
+comment on table public.notion_sync_state is 'Per-user cursor for incremental Notion sync.';
+
+create table public.notion_page_checkpoints (
+    user_id uuid not null references auth.users (id) on delete cascade,
+    page_id text not null,                        -- Notion page id
+    document_id uuid not null references public.documents (id) on delete cascade,
+    last_edited_time timestamp with time zone not null,  -- page last_edited_time at last sync
+    synced_at timestamp with time zone default timezone('utc'::text, now()) not null,
+    primary key (user_id, page_id)
+);
+
+comment on table public.notion_page_checkpoints is 'Per-page last_edited_time checkpoints for incremental Notion sync.';
+
+create index idx_notion_page_checkpoints_document_id on public.notion_page_checkpoints(document_id);
+
+-- Only the backend (service role) reads and writes sync state
+alter table public.notion_sync_state enable row level security;
+alter table public.notion_page_checkpoints enable row level security;
+
+create policy "Allow service role to manage notion sync state"
+    on public.notion_sync_state
+    for all
+    to service_role
+    using (true)
+    with check (true);
+
+create policy "Allow service role to manage notion page checkpoints"
+    on public.notion_page_checkpoints
+    for all
+    to service_role
+    using (true)
+    with check (true);
+
+grant all on public.notion_sync_state to service_role;
+grant all on public.notion_page_checkpoints to service_role;
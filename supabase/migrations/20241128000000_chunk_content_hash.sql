@@ -0,0 +1,50 @@
+-- Migration: content hashes for deduplicated chunk writes
+--
+-- Chunks used to be inserted blindly, so re-ingesting a document duplicated
+-- every row (and grew the ivfflat index). Each chunk now carries a sha256 of
+-- its content; the backend upserts on (document_id, content_hash), only
+-- embeds chunks it hasn't stored before, and removes chunks that disappeared
+-- from a re-ingested document with delete_stale_chunks.
+
+alter table public.chunks add column content_hash text;
+
+comment on column public.chunks.content_hash is 'sha256 (hex) of content, unique per document.';
+
+-- Backfill existing rows the same way the backend hashes them
+update public.chunks
+set content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+where content_hash is null;
+
+-- Drop duplicates already in the table, keeping the first copy of each
+delete from public.chunks as duplicate
+using public.chunks as original
+where duplicate.document_id = original.document_id
+  and duplicate.content_hash = original.content_hash
+  and duplicate.id > original.id;
+
+alter table public.chunks alter column content_hash set not null;
+
+create unique index idx_chunks_document_id_content_hash on public.chunks (document_id, content_hash);
+
+-- Delete the chunks of a document whose hashes aren't in keep_hashes, in one
+-- statement. The hash list goes in the request body, so it isn't limited by
+-- URL length the way a not.in filter would be.
+create or replace function public.delete_stale_chunks(
+  target_document_id uuid,           -- document that was re-ingested
+  keep_hashes text[]                 -- content hashes of its current chunks
+)
+returns int
+language plpgsql
+as $$
+declare
+  deleted int;
+begin
+  delete from public.chunks
+  where document_id = target_document_id
+    and not (content_hash = any(keep_hashes));
+  get diagnostics deleted = row_count;
+  return deleted;
+end;
+$$;
+
+grant execute on function public.delete_stale_chunks(uuid, text[]) to service_role;
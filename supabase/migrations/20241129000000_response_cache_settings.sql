@@ -0,0 +1,14 @@
+-- Migration: per-user settings for the public chat response cache
+--
+-- Public visitors often ask a mirrored persona the same question in slightly
+-- different words. Users who opt in get near-identical questions answered
+-- with a previously generated reply instead of a new LLM call. The threshold
+-- is the minimum cosine similarity between query embeddings; null uses the
+-- backend default (RESPONSE_CACHE_THRESHOLD).
+
+alter table public.profiles
+add column response_cache_enabled boolean not null default false,
+add column response_cache_threshold real null check (response_cache_threshold > 0 and response_cache_threshold <= 1);
+
+comment on column public.profiles.response_cache_enabled is 'Reuse public chat replies for near-identical questions';
+comment on column public.profiles.response_cache_threshold is 'Optional: minimum query similarity for a cached reply (default set by the backend)';
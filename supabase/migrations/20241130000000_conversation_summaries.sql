@@ -0,0 +1,16 @@
+-- Migration: rolling summaries of conversation history
+--
+-- Replies are generated from the last few messages of a conversation plus a
+-- running summary of everything before them, so prompts stay the same size
+-- however long the conversation gets. summary_message_id is the newest
+-- message folded into the summary; later messages are still read verbatim.
+
+alter table public.conversations
+add column summary text null,
+add column summary_message_id bigint null;
+
+comment on column public.conversations.summary is 'Rolling summary of messages up to summary_message_id, maintained by the backend';
+comment on column public.conversations.summary_message_id is 'Newest message included in summary';
+
+-- The backend reads the latest messages of a conversation newest first
+create index idx_messages_conversation_id_id on public.messages(conversation_id, id desc);
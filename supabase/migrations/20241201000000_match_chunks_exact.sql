@@ -0,0 +1,62 @@
+-- Migration: exact per-user search in match_chunks
+--
+-- match_chunks ordered the whole chunks table by distance, so the planner
+-- used the shared ivfflat index (lists = 100, probes = 1) and only applied
+-- the user filter to what that scan returned: about 1% of all tenants'
+-- chunks. Users with a few hundred chunks often got far fewer than
+-- match_count candidates, sometimes none.
+--
+-- The user's chunks are now selected first, in a materialized CTE (served
+-- by the user_id / document_id indexes), and ranked exactly. A per-user
+-- corpus is small enough for this to be cheaper than an approximate scan
+-- of everyone's rows; larger corpora are served by the backend's local
+-- vector index instead.
+
+create or replace function public.match_chunks(
+  query_embedding vector(512),       -- the embedding vector for the query (input_type = 'query')
+  current_user_id uuid,              -- the owner of the chunks to search
+  match_count int default 50,        -- number of candidates (N) to return
+  source_filter text default null    -- optional documents.scrape_source filter
+)
+returns table (
+  id bigint,                         -- chunk id
+  document_id uuid,                  -- document the chunk belongs to
+  content text,                      -- chunk content
+  chunk_index int,                   -- position of the chunk inside its document
+  similarity float,                  -- cosine similarity to the query
+  source text                        -- documents.scrape_source
+)
+language plpgsql
+stable
+as $$
+begin
+  return query
+  with user_chunks as materialized (
+    select
+      chunks.id,
+      chunks.document_id,
+      chunks.content,
+      chunks.chunk_index,
+      chunks.embeddings <=> query_embedding as distance,
+      documents.scrape_source as source
+    from public.chunks as chunks
+    join public.documents as documents on chunks.document_id = documents.id
+    where documents.user_id = current_user_id
+      and chunks.embeddings is not null
+      and (source_filter is null or documents.scrape_source = source_filter)
+  )
+  select
+    user_chunks.id,
+    user_chunks.document_id,
+    user_chunks.content,
+    user_chunks.chunk_index,
+    1 - user_chunks.distance as similarity,
+    user_chunks.source
+  from user_chunks
+  -- ranking the CTE's rows can't use the shared ivfflat index, so this is exact
+  order by user_chunks.distance
+  limit match_count;
+end;
+$$;
+
+grant execute on function public.match_chunks(vector, uuid, int, text) to authenticated, service_role;
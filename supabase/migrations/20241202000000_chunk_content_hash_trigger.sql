@@ -0,0 +1,21 @@
+-- Migration: compute chunks.content_hash in the database
+--
+-- content_hash is not null, but the voyage edge function (used by the
+-- frontend to add content) inserts chunks without it, so those inserts
+-- failed. The hash is now set by a trigger on every insert, and on updates
+-- of content, the same way the backend computes it; the backend's value is
+-- simply recomputed.
+
+create or replace function public.set_chunk_content_hash()
+returns trigger
+language plpgsql
+as $$
+begin
+  new.content_hash := encode(sha256(convert_to(new.content, 'UTF8')), 'hex');
+  return new;
+end;
+$$;
+
+create trigger set_chunk_content_hash
+before insert or update of content on public.chunks
+for each row execute function public.set_chunk_content_hash();
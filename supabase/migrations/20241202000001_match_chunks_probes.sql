@@ -0,0 +1,97 @@
+-- Migration: indexed match_chunks with enough probes, exact only for small corpora
+--
+-- 20241201000000 ranked every chunk of the user exactly, which made each
+-- chat query cost O(user corpus). The ivfflat index is used again, with two
+-- changes to the recall problem it had (probes = 1 over lists = 100 scanned
+-- ~1% of all tenants' rows before the user filter):
+--
+--   * Users with at most exact_scan_limit (5000) embedded chunks are ranked
+--     exactly. That bounds the exact scan to 5000 distance computations; the
+--     count that picks the path stops at the bound too.
+--   * Larger corpora use the index with ivfflat.probes = 10, set for this
+--     function only. Probing 10 of 100 lists sees ~10% of the user's chunks,
+--     over 500 for a corpus above the bound: well above match_count.
+
+create or replace function public.match_chunks(
+  query_embedding vector(512),       -- the embedding vector for the query (input_type = 'query')
+  current_user_id uuid,              -- the owner of the chunks to search
+  match_count int default 50,        -- number of candidates (N) to return
+  source_filter text default null    -- optional documents.scrape_source filter
+)
+returns table (
+  id bigint,                         -- chunk id
+  document_id uuid,                  -- document the chunk belongs to
+  content text,                      -- chunk content
+  chunk_index int,                   -- position of the chunk inside its document
+  similarity float,                  -- cosine similarity to the query
+  source text                        -- documents.scrape_source
+)
+language plpgsql
+stable
+set ivfflat.probes = 10
+as $$
+declare
+  exact_scan_limit constant int := 5000;
+  user_chunk_count int;
+begin
+  select count(*) into user_chunk_count
+  from (
+    select 1
+    from public.chunks as chunks
+    join public.documents as documents on chunks.document_id = documents.id
+    where documents.user_id = current_user_id
+      and chunks.embeddings is not null
+      and (source_filter is null or documents.scrape_source = source_filter)
+    limit exact_scan_limit + 1
+  ) as bounded;
+
+  if user_chunk_count <= exact_scan_limit then
+    return query
+    with user_chunks as materialized (
+      select
+        chunks.id,
+        chunks.document_id,
+        chunks.content,
+        chunks.chunk_index,
+        chunks.embeddings <=> query_embedding as distance,
+        documents.scrape_source as source
+      from public.chunks as chunks
+      join public.documents as documents on chunks.document_id = documents.id
+      where documents.user_id = current_user_id
+        and chunks.embeddings is not null
+        and (source_filter is null or documents.scrape_source = source_filter)
+    )
+    select
+      user_chunks.id,
+      user_chunks.document_id,
+      user_chunks.content,
+      user_chunks.chunk_index,
+      1 - user_chunks.distance as similarity,
+      user_chunks.source
+    from user_chunks
+    -- at most exact_scan_limit rows, ranked exactly
+    order by user_chunks.distance
+    limit match_count;
+    return;
+  end if;
+
+  return query
+  select
+    chunks.id,
+    chunks.document_id,
+    chunks.content,
+    chunks.chunk_index,
+    1 - (chunks.embeddings <=> query_embedding) as similarity,
+    documents.scrape_source as source
+  from public.chunks as chunks
+  join public.documents as documents on chunks.document_id = documents.id
+  where documents.user_id = current_user_id
+    and chunks.embeddings is not null
+    and (source_filter is null or documents.scrape_source = source_filter)
+  -- order by the distance operator directly so the ivfflat index can be used
+  order by chunks.embeddings <=> query_embedding
+  limit match_count;
+end;
+$$;
+
+grant execute on function public.match_chunks(vector, uuid, int, text) to authenticated, service_role;